@@ -0,0 +1,11 @@
+from .store import PointStore
+from .diff import AnnotationDelta, diff_points
+from .protocol import apply_component_value, new_sync_state
+from .journal import AnnotationJournal
+from .persistence import persist
+from .render import AnnotationRenderer
+from .loader import load_annotation_csv, LoadedAnnotations, MalformedRow
+from .repository import SqliteRepository
+from .manifest import ImageManifest
+from .retention import RetentionPolicy
+from .marker import Marker
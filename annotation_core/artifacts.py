@@ -0,0 +1,55 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Memory budget for the downloadable results kept across sessions, in megabytes
+ARTIFACT_CACHE_MB = int(os.environ.get("ANNOTATOR_ARTIFACT_CACHE_MB", "64"))
+
+
+class ArtifactCache:
+    """
+    Process-wide LRU cache of the downloadable results (CSV, report and
+    annotated PNG) of an image.
+
+    Entries are keyed by the image (its stored object, or its path,
+    modification time and size) and the fingerprint of the annotations, so
+    a session that reopens an image, or reconnects, gets back the results
+    built for the same inputs instead of rendering them again. The least
+    recently used entries are dropped once their total size exceeds
+    `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=ARTIFACT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(entry):
+        return sum(len(value) for value in entry.values() if isinstance(value, (bytes, str)))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self._nbytes += self._size(entry)
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= self._size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+artifacts = ArtifactCache()
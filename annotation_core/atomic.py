@@ -0,0 +1,143 @@
+import itertools
+import os
+import threading
+import time
+from pathlib import Path
+
+# When written files reach the disk: "always" syncs every file before it
+# replaces the previous one, "group" does the same but lets the writes that
+# arrive within ANNOTATOR_FSYNC_WINDOW_MS share one commit, and "never"
+# leaves it to the OS. Files are replaced atomically in every mode.
+FSYNC = os.environ.get("ANNOTATOR_FSYNC", "group").lower()
+FSYNC_WINDOW = float(os.environ.get("ANNOTATOR_FSYNC_WINDOW_MS", "5")) / 1000
+
+_counter = itertools.count()
+
+
+def _fsync_dirs(directories):
+    if os.name != "posix":
+        return
+    for directory in directories:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class _Batch:
+    def __init__(self):
+        self.items = {}  # final path -> temporary file, the latest write wins
+        self.done = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            for tmp_path in self.items.values():
+                fd = os.open(tmp_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            for path, tmp_path in self.items.items():
+                os.replace(tmp_path, path)
+            _fsync_dirs({os.path.dirname(path) for path in self.items})
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+class GroupCommit:
+    """
+    Syncs and renames the temporary files of `atomic_write` in batches.
+
+    The first writer of a batch waits `window` seconds for others to join,
+    then syncs every file of the batch, moves them in place and syncs their
+    folders once, while the other writers wait for it. Batches commit one at
+    a time and in order, and when a file is written twice in one batch only
+    the latest version is synced.
+    """
+
+    def __init__(self, window=FSYNC_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._batch = None
+
+    def commit(self, tmp_path, path):
+        self.commit_many([(tmp_path, path)])
+
+    def commit_many(self, files):
+        """Commits (temporary file, final path) pairs in one batch, in order."""
+        with self._lock:
+            leader = self._batch is None
+            if leader:
+                self._batch = _Batch()
+            batch = self._batch
+            superseded = [batch.items[path] for _, path in files if path in batch.items]
+            for tmp_path, path in files:
+                batch.items[path] = tmp_path
+        for tmp_path in superseded:
+            os.remove(tmp_path)
+
+        if leader:
+            if self.window > 0:
+                time.sleep(self.window)
+            with self._commit_lock:
+                # Writers keep joining until the previous batch is committed
+                with self._lock:
+                    self._batch = None
+                batch.run()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+
+
+_group = GroupCommit()
+
+
+def atomic_write(path, data, encoding="utf-8"):
+    """
+    Replaces the contents of `path` with `data` (str or bytes) so that
+    readers see either the previous file or the new one, never a partial
+    write. The data is written to a temporary file next to `path`, synced
+    according to `FSYNC`, and renamed over it.
+    """
+    atomic_write_many([(path, data)], encoding)
+
+
+def atomic_write_many(files, encoding="utf-8"):
+    """
+    Replaces several files, given as (path, data) pairs, like `atomic_write`
+    but committed together: with "group" they share one batch, so a thread
+    that writes files that belong together (the CSV and the report of an
+    image) waits for one commit instead of one per file. Each file is
+    replaced atomically and in the order given; readers may still see some
+    of them replaced before the others.
+    """
+    staged = []
+    for path, data in files:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp-{os.getpid()}-{next(_counter)}")
+
+        mode = "wb" if isinstance(data, bytes) else "w"
+        with open(tmp_path, mode, encoding=None if mode == "wb" else encoding) as tmp_file:
+            tmp_file.write(data)
+            if FSYNC == "always":
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+        staged.append((str(tmp_path), str(path)))
+
+    if not staged:
+        return
+    if FSYNC == "group":
+        _group.commit_many(staged)
+    else:
+        for tmp_path, path in staged:
+            os.replace(tmp_path, path)
+        if FSYNC == "always":
+            _fsync_dirs({os.path.dirname(path) for _, path in staged})
@@ -0,0 +1,241 @@
+"""
+Regenerates the annotation CSVs, reports and annotated images of a marker
+outside the Streamlit app, in parallel:
+
+    python -m annotation_core.batch her2
+    python -m annotation_core.batch ki67 --workers 8 --force
+    python -m annotation_core.batch her2 --data-dir her2_annotator/data/workspaces/<name>
+
+Images whose outputs were built from the same image, annotations, labels
+and marker definition are skipped, unless `--force` is given. Images that
+were never annotated are skipped too, and the outputs of an image whose CSV
+has malformed rows are not rebuilt, so those rows are never dropped from it.
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from PIL import Image
+from streamlit.logger import get_logger
+
+# The engine is a Streamlit page; running it without a script context is expected here
+get_logger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+
+from .atomic import atomic_write_many
+from .engine import Annotator
+from .render import AnnotationRenderer
+
+ANNOTATED_DIR = "annotated"
+
+
+class BatchAnnotator(Annotator):
+    """Annotator without a Streamlit session: missing and malformed annotations are recorded instead of shown."""
+
+    def __init__(self, marker):
+        super().__init__(marker)
+        self.missing = False
+        self.malformed = []
+
+    def report_missing(self, csv_filename):
+        self.missing = True
+
+    def report_malformed(self, csv_filename, malformed):
+        # Rows skipped from a journal are not lost by rewriting the CSV
+        if Path(csv_filename).suffix == ".csv":
+            self.malformed.extend(malformed)
+
+    def keep_original(self, csv_filename):
+        # The batch never rewrites annotation CSVs
+        return None
+
+
+def resolve_marker(name, data_dir=None):
+    """
+    Imports the `Marker` of an annotator module, given as a short name
+    ("her2" -> her2_annotator.her2_annotation) or as a module path.
+    """
+    module_name = name if "." in name else f"{name}_annotator.{name}_annotation"
+    marker = importlib.import_module(module_name).marker
+    if data_dir is not None:
+        data_dir = Path(data_dir).absolute()
+        marker = marker._replace(data_dir=data_dir, log_file=data_dir / marker.log_file.name)
+    return marker
+
+
+def definition_key(marker):
+    """Changes when the labels, colors or the module that defines the marker change."""
+    module = sys.modules.get(marker.build_report.__module__)
+    module_file = getattr(module, "__file__", None)
+    stat = os.stat(module_file) if module_file else None
+    return json.dumps([
+        marker.label_list,
+        sorted((int(idx), list(color)) for idx, color in marker.label_colors.items()),
+        module_file and [stat.st_mtime_ns, stat.st_size],
+    ])
+
+
+# Worker processes
+_annotator = None
+_definition = None
+
+
+def _init_worker(marker_name, data_dir):
+    global _annotator, _definition
+    _annotator = BatchAnnotator(resolve_marker(marker_name, data_dir))
+    _definition = definition_key(_annotator.marker)
+
+
+def process_image(base_name, image_file_name, output_dir, force=False, render=True):
+    """
+    Rebuilds the CSV, the report and (optionally) the annotated image of one
+    image. Runs in a worker process.
+
+    Nothing is written for an image without annotations ('unannotated') or
+    whose CSV has malformed rows ('malformed'): rewriting it would drop them.
+
+    Returns:
+        dict: 'name', 'status' ('built', 'skipped', 'unannotated' or 'malformed'),
+        'points', 'malformed' and 'seconds'.
+    """
+    start = time.perf_counter()
+    marker = _annotator.marker
+    _annotator.missing = False
+    _annotator.malformed = []
+
+    image_path = marker.image_dir / image_file_name
+    store = _annotator.load_results(base_name)
+
+    result = {"name": base_name, "points": len(store), "malformed": len(_annotator.malformed)}
+    if _annotator.missing and not len(store):
+        return dict(result, status="unannotated", seconds=time.perf_counter() - start)
+    if _annotator.malformed:
+        return dict(result, status="malformed", seconds=time.perf_counter() - start)
+
+    image_stat = os.stat(image_path)
+    stamp = hashlib.blake2b(
+        f"{image_stat.st_size}:{image_stat.st_mtime_ns}:{store.fingerprint()}:{_definition}:{render}".encode("utf-8"),
+        digest_size=16
+    ).hexdigest()
+
+    csv_path = marker.ann_dir / f"{base_name}.csv"
+    report_path = marker.report_dir / f"{base_name}.txt"
+    png_path = Path(output_dir) / f"{base_name}_annotated.png"
+    stamp_path = Path(output_dir) / f".{base_name}.stamp"
+    outputs = [csv_path, report_path] + ([png_path] if render else [])
+
+    try:
+        up_to_date = (
+            stamp_path.read_text(encoding="utf-8") == stamp
+            and all(path.exists() for path in outputs)
+        )
+    except FileNotFoundError:
+        up_to_date = False
+
+    if up_to_date and not force:
+        return dict(result, status="skipped", seconds=time.perf_counter() - start)
+
+    files = [
+        (csv_path, store.to_csv(marker.label_list)),
+        (report_path, marker.build_report(marker.label_list, store, base_name)),
+    ]
+    if render:
+        image = Image.open(image_path)
+        point_radius, outline_width = marker.point_style(image.size)
+        renderer = AnnotationRenderer(image, marker.label_colors, point_radius, outline_width)
+        renderer.update(store)
+        files.append((png_path, renderer.encode()))
+    # One commit per image; the stamp goes in last
+    atomic_write_many(files + [(stamp_path, stamp)])
+
+    return dict(result, status="built", seconds=time.perf_counter() - start)
+
+
+def _progress(done, total, start, name):
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = (total - done) / rate if rate > 0 else 0.0
+    sys.stderr.write(
+        f"\r[{done:>{len(str(total))}}/{total}] {100 * done / total:5.1f}%  {rate:6.1f} img/s  "
+        f"ETA {int(eta) // 60:02d}:{int(eta) % 60:02d}  {name[:40]:<40}"
+    )
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m annotation_core.batch",
+        description="Regenerates the annotation CSVs, reports and annotated images of a marker."
+    )
+    parser.add_argument("marker", help="Annotator: her2, ki67, estr, prog or a module path")
+    parser.add_argument("names", nargs="*", help="Images to process (base names). Defaults to every stored image")
+    parser.add_argument("--data-dir", help="Data folder to process instead of the one of the marker (e.g. a workspace)")
+    parser.add_argument("--output", help=f"Folder of the annotated images. Defaults to <data dir>/{ANNOTATED_DIR}")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--force", action="store_true", help="Rebuild outputs that are up to date")
+    parser.add_argument("--no-images", action="store_true", help="Only rebuild the CSVs and reports")
+    args = parser.parse_args(argv)
+
+    annotator = BatchAnnotator(resolve_marker(args.marker, args.data_dir))
+    marker = annotator.marker
+    annotator.create_dirs()
+    output_dir = Path(args.output) if args.output else marker.data_dir / ANNOTATED_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # The manifest rescans the folders if they changed since it was written
+    entries = annotator.manifest.entries()
+    names = args.names or sorted(entries)
+    missing = [name for name in names if name not in entries]
+    for name in missing:
+        print(f"No image named '{name}' in {marker.image_dir}", file=sys.stderr)
+    names = [name for name in names if name in entries]
+    if not names:
+        print(f"Nothing to process in {marker.image_dir}", file=sys.stderr)
+        return 1 if missing else 0
+
+    counts = {"built": 0, "skipped": 0, "unannotated": 0, "malformed": 0, "failed": 0}
+    points = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=max(1, args.workers), initializer=_init_worker, initargs=(args.marker, args.data_dir)
+    ) as executor:
+        futures = {
+            executor.submit(process_image, name, entries[name]["image"], output_dir, args.force, not args.no_images): name
+            for name in names
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                counts["failed"] += 1
+                sys.stderr.write(f"\nError processing '{name}': {e}\n")
+            else:
+                counts[result["status"]] += 1
+                points += result["points"]
+                if result["status"] == "built":
+                    annotator.manifest.add_results(name)
+                if result["status"] == "malformed":
+                    sys.stderr.write(
+                        f"\n'{name}': {result['malformed']} malformed rows in its CSV, not rebuilt (fix or remove them first)\n"
+                    )
+            _progress(done, len(names), start, name)
+
+    elapsed = time.perf_counter() - start
+    sys.stderr.write("\n")
+    print(
+        f"{marker.name}: {counts['built']} built, {counts['skipped']} up to date, "
+        f"{counts['unannotated']} without annotations, {counts['malformed']} with malformed rows, "
+        f"{counts['failed']} failed, {points} points in {elapsed:.1f} s ({len(names) / elapsed:.1f} img/s)"
+    )
+    return 1 if counts["failed"] or counts["malformed"] or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
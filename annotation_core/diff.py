@@ -0,0 +1,75 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+def _empty():
+    return np.empty((0, 3), dtype=np.int64)
+
+
+class AnnotationDelta(NamedTuple):
+    """
+    Changes between two annotation states. Every field is an (n, 3) integer
+    array of (x, y, label id) rows; for `removed` the label is the one the
+    point had before it was deleted, for `relabeled` it is the new one.
+    """
+    added: np.ndarray
+    removed: np.ndarray
+    relabeled: np.ndarray
+
+    @classmethod
+    def empty(cls):
+        return cls(_empty(), _empty(), _empty())
+
+    def __bool__(self):
+        return bool(len(self.added) or len(self.removed) or len(self.relabeled))
+
+
+def point_keys(x, y):
+    """
+    Packs integer coordinates into one int64 key per point. The y coordinate
+    takes the low 32 bits, masked so a negative y does not overwrite x.
+    """
+    return (np.asarray(x, dtype=np.int64) << 32) | (np.asarray(y, dtype=np.int64) & 0xFFFFFFFF)
+
+
+def diff_points(store, x, y, labels):
+    """
+    Computes the delta that turns the contents of `store` into the given
+    points, using sorted-array set operations on packed coordinate keys.
+    This is O((N + M) log(N + M)) instead of comparing every stored point
+    against every incoming one.
+
+    Args:
+        store (PointStore): Current annotations.
+        x, y (array-like): Integer coordinates of the incoming points.
+        labels (array-like): Label id of each incoming point.
+
+    Returns:
+        AnnotationDelta: Points to add, remove and relabel. The store is not modified.
+    """
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    labels = np.asarray(labels, dtype=np.int64)
+
+    # Repeated coordinates in the payload keep their first label
+    new_keys, first = np.unique(point_keys(x, y), return_index=True)
+    x, y, labels = x[first], y[first], labels[first]
+
+    old_x = store.x.astype(np.int64)
+    old_y = store.y.astype(np.int64)
+    old_labels = store.labels.astype(np.int64)
+    old_keys = point_keys(old_x, old_y)
+
+    added = ~np.isin(new_keys, old_keys, assume_unique=True)
+    removed = ~np.isin(old_keys, new_keys, assume_unique=True)
+
+    _, old_idx, new_idx = np.intersect1d(old_keys, new_keys, assume_unique=True, return_indices=True)
+    changed = old_labels[old_idx] != labels[new_idx]
+    relabeled = new_idx[changed]
+
+    return AnnotationDelta(
+        added=np.column_stack((x[added], y[added], labels[added])),
+        removed=np.column_stack((old_x[removed], old_y[removed], old_labels[removed])),
+        relabeled=np.column_stack((x[relabeled], y[relabeled], labels[relabeled])),
+    )
@@ -0,0 +1,726 @@
+import glob
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from functools import partial
+from pathlib import Path
+
+import streamlit as st
+from PIL import Image
+
+from streamlit_image_annotation import pointdet
+from streamlit_image_annotation.Point.tiles import delete_pyramids
+from . import PointStore, AnnotationJournal, apply_component_value, new_sync_state, persist, AnnotationRenderer, ImageManifest, SqliteRepository
+from .image_store import ImageStore, OBJECTS_DIR
+from .artifacts import artifacts
+from .repository import STORAGE_BACKEND, DATABASE_FILE
+from .loader import load_annotation_csv
+from .atomic import atomic_write
+from .retention import janitor, ACTIVE_TIMEOUT
+
+actions = ['Agregar', 'Borrar']
+
+# Opt-in: ANNOTATOR_WORKSPACES=1 gives every session its own images, annotations,
+# reports and latest image under <data_dir>/workspaces/<workspace>. The workspace
+# is taken from the "workspace" query parameter, or a new one is created and
+# added to the URL, so reloading the page (or reconnecting) keeps it.
+SESSION_WORKSPACES = os.environ.get("ANNOTATOR_WORKSPACES", "0") == "1"
+WORKSPACES_DIR = "workspaces"
+WORKSPACE_PARAM = "workspace"
+
+
+def current_workspace(session_state):
+    """Name of the workspace of the session, created on first use."""
+    workspace = session_state.get('workspace')
+    if workspace is None:
+        workspace = st.query_params.get(WORKSPACE_PARAM, "")
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", workspace):
+            workspace = uuid.uuid4().hex[:16]
+        st.query_params[WORKSPACE_PARAM] = workspace
+        session_state['workspace'] = workspace
+    return workspace
+
+
+class Annotator:
+    """
+    Annotation app of one marker. The Streamlit pages of every marker run
+    this same engine, parameterized by a `Marker` definition, so the display
+    image cache, the persistence worker and the other process-wide caches
+    are shared by all of them.
+
+    With `SESSION_WORKSPACES`, the annotator of a marker hands every session
+    to the annotator of its workspace (see `in_workspace`), which runs on its
+    own folders and latest session log. Uploaded images are still stored
+    once, in the image store of the marker. Workspaces that no session has
+    used for `ACTIVE_TIMEOUT` seconds are dropped, and built again from their
+    folders when they come back.
+    """
+
+    def __init__(self, marker, images=None, workspace=None):
+        self.marker = marker
+        self.workspace = workspace
+        self._manifest = None
+        self._repository = None
+        self.images = images or ImageStore(self.marker.data_dir / OBJECTS_DIR)
+        self._workspaces = {}
+        self.last_used = time.monotonic()  # Last time a session asked for this workspace
+        self.open_images = {}  # base name -> last time (monotonic) a session used it
+        self._workspaces_lock = threading.Lock()
+
+    def in_workspace(self, workspace):
+        """Annotator of the marker that keeps its files under `<data_dir>/workspaces/<workspace>`."""
+        now = time.monotonic()
+        with self._workspaces_lock:
+            # Idle workspaces are not kept in memory, nor swept by the janitor
+            for name, idle in list(self._workspaces.items()):
+                if now - idle.last_used >= ACTIVE_TIMEOUT:
+                    del self._workspaces[name]
+                    janitor.forget(idle)
+
+            annotator = self._workspaces.get(workspace)
+            if annotator is None:
+                data_dir = self.marker.data_dir / WORKSPACES_DIR / workspace
+                marker = self.marker._replace(data_dir=data_dir, log_file=data_dir / self.marker.log_file.name)
+                annotator = Annotator(marker, self.images, workspace)
+                self._workspaces[workspace] = annotator
+            annotator.last_used = now
+            return annotator
+
+    def create_dirs(self):
+        """Creates the data directories. Called when the annotator is used, not on import."""
+        for directory in (self.marker.data_dir, self.marker.image_dir, self.marker.ann_dir, self.marker.report_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def manifest(self):
+        """Index of the stored images, loaded (or built) on first use."""
+        if self._manifest is None:
+            self._manifest = ImageManifest(self.marker.data_dir, self.marker.image_dir, self.marker.ann_dir, self.marker.report_dir)
+        return self._manifest
+
+    @property
+    def repository(self):
+        """SQLite repository of the annotations, or None when they are stored as CSV files."""
+        if self._repository is None and STORAGE_BACKEND == "sqlite":
+            self._repository = SqliteRepository(self.marker.data_dir / DATABASE_FILE, self.marker.label_list)
+        return self._repository
+
+    def init_session(self, session_state, file_name):
+        session_state.update({
+            'store': PointStore(),
+            'sync': new_sync_state(oplog=session_state.get('sync', {}).get('oplog', False)),  # Same frontend, same protocol
+            'journal': AnnotationJournal(f"{self.marker.ann_dir}/{file_name}.csv", self.marker.label_list),
+            'downloads': None,  # Built when the results are downloaded
+            'renderer': None  # Built on the first change
+        })
+
+    def update_results(self, session_state, store, file_name, delta=None):
+        """
+        Journals the latest changes. The CSV snapshot and the report are only
+        written to disk when the journal is compacted (see `compact_results`),
+        and the downloadable results are built on request (see `prepare_downloads`).
+        """
+        journal = session_state['journal']
+        if delta:
+            journal.append(delta)
+
+        if journal.needs_compaction():
+            self.compact_results(session_state, store, file_name)
+
+    def compact_results(self, session_state, store, file_name):
+        """
+        Seals the journal and writes the canonical CSV and the report of the
+        current annotations. Runs on a timer from `update_results`, when
+        switching images and when the results are downloaded.
+        """
+        journal = session_state['journal']
+        sealed = journal.seal()
+        persist((id(session_state), 'compact', file_name), self.write_results, journal, store.snapshot(), file_name, sealed)
+
+    def write_results(self, journal, store, file_name, sealed):
+
+        save = partial(self.repository.save, file_name) if self.repository is not None else None
+
+        # The report is committed with the CSV
+        report_filename = f"{self.marker.report_dir}/{file_name}.txt"
+        report = self.marker.build_report(self.marker.label_list, store, file_name)
+        journal.compact(store, sealed, save, files=[(report_filename, report)])
+
+        self.manifest.add_results(file_name)
+
+    def update_annotations(self, new_labels, store, session_state):
+        """
+        Applies the edits returned by the frontend to the store.
+
+        Args:
+            new_labels: Value returned by `pointdet` (operation log or full point list).
+            store (PointStore): Current annotations. Updated in place.
+            session_state: dict where the store and the canvas sync state are kept.
+
+        Returns:
+            tuple: A tuple containing:
+                - delta (AnnotationDelta): The points that were added, removed or relabeled.
+                - rerun (bool): True if the canvas has to be resynchronized.
+        """
+        delta, rerun = apply_component_value(store, new_labels, session_state['sync'])
+
+        session_state['store'] = store
+
+        return delta, rerun
+
+    def update_ann_image(self, session_state, store, image):
+        """
+        Overlays points on the image with colors corresponding to their labels.
+        Only the points that changed since the last call are drawn.
+
+        Args:
+            session_state: dict where the renderer of the current image is kept.
+            store: PointStore with the points (x, y) and their label ids.
+            image: PIL.Image object representing the base image.
+
+        Returns:
+            AnnotationRenderer: The renderer, up to date with `store`.
+        """
+        renderer = session_state.get('renderer')
+        if renderer is None:
+            point_radius, outline_width = self.marker.point_style(image.size)
+            renderer = AnnotationRenderer(image, self.marker.label_colors, point_radius, outline_width)
+            session_state['renderer'] = renderer
+
+        renderer.update(store)
+
+        return renderer
+
+    def artifact_key(self, store, file_name):
+        """
+        Key of the downloadable results of an image in the process-wide
+        artifact cache: the image they are drawn on and the annotations.
+        """
+        entry = self.manifest.get(file_name)
+        if entry is None:
+            return None
+        if entry.get("object"):
+            image_key = entry["object"]
+        else:
+            try:
+                stat = os.stat(f"{self.marker.image_dir}/{entry['image']}")
+            except FileNotFoundError:
+                return None
+            image_key = (entry["image"], stat.st_mtime_ns, stat.st_size)
+        return (self.marker.name, file_name, image_key, store.fingerprint())
+
+    def prepare_downloads(self, session_state, store, image, file_name):
+        """
+        Builds the downloadable results: the annotation CSV, the report and the
+        annotated image. They are memoized by the version of the store, so they
+        are only built again after the annotations change, and cached by their
+        inputs, so sessions that reopen the same image and annotations reuse them.
+
+        Returns:
+            dict: The 'csv', 'report' and 'image' payloads.
+        """
+        downloads = session_state.get('downloads')
+        if downloads is None or downloads['version'] != store.version:
+            key = self.artifact_key(store, file_name)
+            cached = artifacts.get(key) if key is not None else None
+            if cached is not None:
+                downloads = dict(cached, version=store.version)
+            else:
+                renderer = self.update_ann_image(session_state, store, image)
+                downloads = {
+                    'version': store.version,
+                    'csv': store.to_csv(self.marker.label_list),
+                    'report': self.marker.build_report(self.marker.label_list, store, file_name),
+                    'image': renderer.encode(),
+                }
+                if key is not None:
+                    artifacts.put(key, downloads)
+            session_state['downloads'] = downloads
+
+        return downloads
+
+    def recover_session(self, session_state, file_name):
+        """
+        Restores the annotations of an image into the session, read-only:
+        nothing is written back to disk. Changes still in the journal are
+        replayed and left there for the next compaction. Downloadable
+        results built for the same image and annotations are reused.
+
+        Returns:
+            PointStore: The restored annotations.
+        """
+        journal = AnnotationJournal(f"{self.marker.ann_dir}/{file_name}.csv", self.marker.label_list)
+        store = self.load_results(file_name, journal)
+
+        session_state['store'] = store
+        session_state['sync'] = new_sync_state(oplog=session_state.get('sync', {}).get('oplog', False))
+        session_state['renderer'] = None
+        session_state['journal'] = journal
+
+        key = self.artifact_key(store, file_name)
+        cached = artifacts.get(key) if key is not None else None
+        session_state['downloads'] = dict(cached, version=store.version) if cached is not None else None
+
+        return store
+
+    def check_latest_session_log(self, log_path=None):
+        log_path = log_path or self.marker.log_file
+        try:
+            with open(log_path, 'r', encoding='utf-8') as file:
+                contents = file.read()
+
+            return contents
+
+        except FileNotFoundError:
+            return "NoImage"
+        except Exception as e:
+            return "NoImage"
+
+    def store_latest_session_log(self, file_name, log_path=None):
+        log_path = log_path or self.marker.log_file
+        try:
+            atomic_write(log_path, file_name)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+
+    def check_files(self, image_file_name):
+        """
+        Checks if an image (ignoring its extension) is stored in the image
+        folder of the marker. Looked up in the manifest, without listing the folder.
+
+        Args:
+            image_file_name (str): The name of the file to check.
+
+        Returns:
+            bool: True if the file (ignoring extensions) exists, False otherwise.
+        """
+        return self.manifest.has_image(image_file_name)
+
+    def read_results_from_csv(self, csv_filename, journal=None):
+        """
+        Reads the contents of a CSV file created by the `update_results` function
+        and rebuilds the annotation store, replaying the journal of changes
+        that were not compacted into the CSV yet.
+
+        Args:
+            csv_filename (str): Path to the CSV file to read.
+            journal (AnnotationJournal, optional): Journal to replay. Defaults to the one of the CSV.
+
+        Returns:
+            PointStore: Store with the points (x, y) and their label ids.
+        """
+        store = PointStore()
+
+        try:
+            loaded = load_annotation_csv(csv_filename, self.marker.label_list)
+            store = loaded.store
+            self.report_malformed(csv_filename, loaded.malformed)
+            if loaded.malformed:
+                self.keep_original(csv_filename)
+
+        except FileNotFoundError:
+            self.report_missing(csv_filename)
+        except Exception as e:
+            print(f"Error reading the file: {e}")
+            st.error(f"Error al leer las anotaciones de '{os.path.basename(csv_filename)}': {e}")
+
+        return self.replay_journal(store, csv_filename, journal)
+
+    def report_missing(self, csv_filename):
+        """Called when an image has no stored annotations yet."""
+        print(f"Error: File '{csv_filename}' not found.")
+
+    def keep_original(self, csv_filename):
+        """
+        Copies a CSV with malformed rows to `<image>.csv.<digest>.bak` before
+        compaction rewrites it without them. The name depends on the content,
+        so loading the same file again does not add copies.
+        """
+        data = Path(csv_filename).read_bytes()
+        digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+        backup = f"{csv_filename}.{digest}.bak"
+        if not os.path.exists(backup):
+            atomic_write(backup, data)
+        print(f"Original of '{csv_filename}' kept in '{backup}'")
+        st.info(f"Se guardó una copia del archivo original en '{os.path.basename(backup)}'.")
+        return backup
+
+    def report_malformed(self, csv_filename, malformed):
+        """Warns about the rows of an annotation CSV that could not be loaded."""
+        if not malformed:
+            return
+
+        details = "; ".join(f"line {entry.line}: {entry.reason}" for entry in malformed)
+        print(f"Skipped {len(malformed)} malformed rows of '{csv_filename}': {details}")
+
+        lines = ", ".join(str(entry.line) for entry in malformed[:10])
+        if len(malformed) > 10:
+            lines += f" y {len(malformed) - 10} más"
+        st.warning(
+            f"{len(malformed)} filas de '{os.path.basename(csv_filename)}' no se pudieron leer y no se cargaron (líneas {lines})."
+        )
+
+    def load_results(self, base_name, journal=None):
+        """
+        Rebuilds the annotation store of an image from the configured storage.
+        With the SQLite backend, an image that only has a CSV (annotated
+        before the switch) is imported into the database on first load.
+
+        Args:
+            base_name (str): Name of the image, without extension.
+            journal (AnnotationJournal, optional): Journal to replay. Defaults to the one of the image.
+
+        Returns:
+            PointStore: Store with the points (x, y) and their label ids.
+        """
+        csv_file_name = f"{self.marker.ann_dir}/{base_name}.csv"
+        if self.repository is None:
+            return self.read_results_from_csv(csv_file_name, journal)
+
+        store = self.repository.load(base_name)
+        if store is None:
+            if os.path.exists(csv_file_name):
+                loaded = self.repository.import_csv(base_name, csv_file_name)
+                store = loaded.store
+                self.report_malformed(csv_file_name, loaded.malformed)
+                if loaded.malformed:
+                    self.keep_original(csv_file_name)
+            else:
+                self.report_missing(csv_file_name)
+                store = PointStore()
+
+        return self.replay_journal(store, csv_file_name, journal)
+
+    def replay_journal(self, store, csv_filename, journal=None):
+        """
+        Replays the changes made after the last snapshot on top of `store`,
+        reporting the journal rows that could not be applied.
+        """
+        if journal is None:
+            journal = AnnotationJournal(csv_filename, self.marker.label_list)
+        journal.replay(store)
+        for path, malformed in journal.malformed.items():
+            self.report_malformed(path, malformed)
+        return store
+
+    def get_image(self):
+        """
+        Returns the uploaded image, or the latest one of a previous session.
+        Images are opened lazily: only their header is read until the pixels
+        are needed.
+
+        Returns:
+            tuple: The image, its file name, its path in the image folder and
+            the uploaded file (None when the image was recovered).
+        """
+
+        image = None     
+        image_file_name = None
+        img_path = None
+
+        # Image upload
+        uploaded_file = st.file_uploader("Subir imagen ", type=["jpg", "jpeg", "png"])
+
+        if uploaded_file is not None:
+            image_file_name = uploaded_file.name
+            image = Image.open(uploaded_file)
+            img_path = f"{self.marker.image_dir}/{image_file_name}"
+
+        # No image was uploaded - We use the latest one from a previous session
+        else: 
+            # Check latest image
+            latest_image = self.check_latest_session_log()
+            result = self.check_files(latest_image)
+
+            if result:
+                # Recover the latest image
+                image_file_name = latest_image
+                image_path = f"{self.marker.image_dir}/{latest_image}"
+                if os.path.exists(image_path):
+                    image = Image.open(image_path)
+                    img_path = image_path
+                else:
+                    st.error(f"Error: File '{image_path}' not found.")
+            else:
+                st.error("No image found in the latest session log.")
+
+        return image, image_file_name, img_path, uploaded_file
+
+    def handle_new_image(self, session_state, image, image_file_name, img_path, uploaded_file=None):
+
+        # We update the name of the current image
+        session_state['image_file_name'] = image_file_name
+
+        # We check if the image was previously annotated
+        result = self.check_files(image_file_name)
+
+        base_name = os.path.splitext(image_file_name)[0]
+
+        # We log the name of the image for session backups, in the same commit as the manifest
+        session_log = [(self.marker.log_file, image_file_name)]
+
+        if result: # Recover previous annotations
+            self.manifest.touch(base_name, files=session_log)
+            self.recover_session(session_state, base_name)
+
+        else: # We store a backup of the image, as uploaded
+            object_name = None
+            if uploaded_file is not None:
+                object_name = self.images.add(uploaded_file, img_path)
+            else:
+                Path(img_path).parent.mkdir(parents=True, exist_ok=True)
+                image.save(img_path)
+            self.manifest.add_image(image_file_name, object_name, files=session_log)
+            if self.repository is not None:
+                self.repository.register_image(base_name, image_file_name, *image.size)
+            self.init_session(session_state, base_name)
+
+    @st.fragment
+    def annotation_canvas(self, session_state, image, image_file_name, img_path, mode, zoom):
+        """
+        Annotation canvas and the updates of its edits. Runs as a fragment, so
+        an edit only reruns this function, not the sidebar, the uploader or the
+        image loading of `image_ann`.
+        """
+        store = session_state['store']
+
+        # Edits only rerun this fragment: keep the image marked as open while it is annotated
+        self.open_images[os.path.splitext(image_file_name)[0]] = time.monotonic()
+
+        # With the operation log, the full point list is only sent when the canvas needs it
+        sync = session_state['sync']
+
+        # Use pointdet to annotate the image
+        new_labels = pointdet(
+            image_path=img_path,
+            label_list=self.marker.label_list,
+            points=store.points() if sync['push'] or not sync['oplog'] else None,
+            labels=store.label_ids() if sync['push'] or not sync['oplog'] else None,
+            width=image.size[0],
+            height=image.size[1],
+            use_space=True,
+            key=img_path,
+            mode=mode,
+            label=session_state['label'],
+            point_width=5,
+            zoom=zoom,
+            label_colors=list(self.marker.label_colors.values()) if self.marker.color_legend else None,
+            ack={'client': sync['client'], 'seq': sync['seq']},
+            resync=sync['resync'],
+            oplog=sync['oplog'],
+        )
+        sync['push'] = False
+
+        # Update points and labels in session state if any changes are made
+        if new_labels is not None:
+
+            # Incorporate the new labels
+            delta, rerun = self.update_annotations(new_labels, store, session_state)
+
+            # Update results only when something changed
+            if delta:
+                base_name = os.path.splitext(image_file_name)[0]
+                self.update_results(session_state, store, base_name, delta)
+
+                # The sidebar is outside the fragment: rerun the app once so
+                # it stops offering the downloads prepared before this edit
+                if session_state.get('downloads') is not None:
+                    session_state['downloads'] = None
+                    rerun = True
+
+            # The canvas lost track of the store, or the sidebar is stale - render again
+            if rerun:
+                st.rerun()
+
+    def image_ann(self, session_state):
+
+        if SESSION_WORKSPACES and self.workspace is None:
+            return self.in_workspace(current_workspace(session_state)).image_ann(session_state)
+
+        self.create_dirs()
+
+        st.sidebar.header("Seleccionar zoom")
+        with st.sidebar:
+            zoom = st.number_input(
+                "Zoom", 
+                min_value=1, 
+                max_value=4, 
+                value=1, 
+                step=1
+            )            
+
+        # Sidebar content
+        st.sidebar.header("Anotación de imágenes")
+        with st.sidebar:
+            if self.marker.color_legend:
+                session_state['action'] = st.selectbox("Acción:", actions)
+                session_state['label'] = st.selectbox("Clase:", self.marker.label_list)
+
+                st.sidebar.subheader("Colores de las clases:")
+                col1, col2 = st.columns(2)
+                for idx, label in enumerate(self.marker.label_list):
+                    color = self.marker.label_colors[idx]
+                    if idx % 2 == 0:
+                        col1.markdown(f"<span style='color:rgb{color}'>{label}</span>", unsafe_allow_html=True)
+                    else:
+                        col2.markdown(f"<span style='color:rgb{color}'>{label}</span>", unsafe_allow_html=True)
+            else:
+                col1, col2 = st.columns([2, 2])
+                with col1:
+                    session_state['action'] = st.selectbox("Acción:", actions)
+
+                with col2:
+                    session_state['label'] = st.selectbox("Clase:", self.marker.label_list)
+
+
+        image, image_file_name, img_path, uploaded_file = self.get_image()
+
+        if image_file_name is not None:
+
+            # Keep the image of the session from being collected while it is open
+            self.open_images[os.path.splitext(image_file_name)[0]] = time.monotonic()
+
+            # Check if a new image is uploaded
+            if 'image_file_name' not in session_state or session_state['image_file_name'] != image_file_name:
+
+                # Compact the journal of the previous image
+                if session_state.get('journal') is not None and session_state['journal'].pending:
+                    previous_name = os.path.splitext(session_state['image_file_name'])[0]
+                    self.compact_results(session_state, session_state['store'], previous_name)
+
+                self.handle_new_image(session_state, image, image_file_name, img_path, uploaded_file)
+
+                # Old images are deleted in the background
+                if self.marker.retention is not None:
+                    janitor.request(self)
+
+            try:
+                store = session_state['store']
+
+                # Translate the selected action
+                action = session_state['action']
+                if action == actions[1]:
+                    mode = 'Del'
+                else:
+                    mode = 'Transform'
+
+
+            # User got disconnected - We recover the previous session
+            except KeyError:
+                base_name = os.path.splitext(image_file_name)[0]
+                store = self.recover_session(session_state, base_name)
+
+                mode  = 'Transform'
+
+
+            self.annotation_canvas(session_state, image, image_file_name, img_path, mode, zoom)
+
+
+
+        # Download results
+        if 'image_file_name' in session_state and image is not None:
+            st.sidebar.header("Resultados")
+            with st.sidebar:
+                image_name = os.path.splitext(session_state['image_file_name'])[0]
+
+                # Pinned images are never deleted by the retention policy
+                if self.marker.retention is not None:
+                    entry = self.manifest.get(image_name) or {}
+                    pinned = st.checkbox("Conservar imagen", value=bool(entry.get('pinned')))
+                    self.manifest.pin(image_name, pinned)
+
+                # The files are built on request, and again after the annotations change
+                downloads = session_state.get('downloads')
+                if downloads is None or downloads['version'] != session_state['store'].version:
+                    downloads = None
+                    if st.button("Preparar descargas"):
+                        downloads = self.prepare_downloads(session_state, session_state['store'], image, image_name)
+
+                if downloads is not None:
+                    # **1st Download Button** - CSV Annotations
+                    st.download_button(
+                        label="Descargar anotaciones (CSV)",
+                        data=downloads['csv'],
+                        file_name=f"{image_name}.csv",
+                        mime="text/csv",
+                        on_click=self.compact_results,
+                        args=(session_state, session_state['store'], image_name)
+                    )
+
+                    # **2nd Download Button** - Annotation Report
+                    st.download_button(
+                        label="Descargar reporte (txt)",
+                        data=downloads['report'],
+                        file_name=f'{image_name}.txt',
+                        mime='text/plain',
+                        on_click=self.compact_results,
+                        args=(session_state, session_state['store'], image_name)
+                    )
+
+                    # **3rd Download Button** - Annotated Image
+                    st.download_button(
+                        label="Descargar imagen anotada (png)",
+                        data=downloads['image'],
+                        file_name=f'{image_name}_annotated.png',
+                        mime='image/png'
+                    )
+
+    def collect_garbage(self):
+        """
+        Deletes the images that the retention policy of the marker no longer
+        keeps, with their annotations and reports. Runs on the janitor thread
+        (see `retention.Janitor`), never on an image switch.
+
+        Returns:
+            list: Base names of the deleted images.
+        """
+        policy = self.marker.retention
+        if policy is None:
+            return []
+
+        now = time.monotonic()
+        for base_name, seen in list(self.open_images.items()):
+            # Unless a session marked it again meanwhile
+            if now - seen >= ACTIVE_TIMEOUT and self.open_images.get(base_name) == seen:
+                self.open_images.pop(base_name, None)
+        active = set(self.open_images)
+        expired = policy.expired(self.manifest.entries(), active)
+        if expired:
+            self.delete_images(expired)
+        return expired
+
+    def delete_images(self, base_names):
+        """Deletes images with their annotations, journals, reports and tile pyramids."""
+        for base_name in base_names:
+            entry = self.manifest.get(base_name)
+            if entry is None:
+                continue
+
+            paths = [
+                f"{self.marker.image_dir}/{entry['image']}",
+                f"{self.marker.ann_dir}/{base_name}.csv",
+                f"{self.marker.report_dir}/{base_name}.txt",
+            ]
+            # Journals, including sealed segments, and copies of malformed CSVs
+            ann_prefix = f"{glob.escape(str(self.marker.ann_dir))}/{glob.escape(base_name)}"
+            paths.extend(glob.glob(f"{ann_prefix}.journal*"))
+            paths.extend(glob.glob(f"{ann_prefix}.csv.*.bak"))
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+            # Every version of the image may have been tiled
+            delete_pyramids(f"{self.marker.image_dir}/{entry['image']}")
+
+            # Stored objects go away with their last alias
+            if entry.get("object"):
+                self.images.release(entry["object"])
+
+        self.manifest.discard(base_names)
+        if self.repository is not None:
+            self.repository.delete(base_names)
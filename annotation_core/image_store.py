@@ -0,0 +1,84 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+OBJECTS_DIR = "objects"
+CHUNK_SIZE = 1024 * 1024
+
+
+class ImageStore:
+    """
+    Content-addressed store of the uploaded images of one marker.
+
+    Uploads are streamed to `<root>/<aa>/<digest><ext>` as they were
+    received, hashing them on the way (BLAKE2b), so they are never decoded
+    and re-encoded, and the same file uploaded under several names is
+    stored once. The image folder only holds aliases: hard links to the
+    stored object (or copies where hard links are not supported), so code
+    that reads `images/<name>` keeps working.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def object_path(self, object_name):
+        return self.root / object_name[:2] / object_name
+
+    def put(self, source, ext=""):
+        """
+        Streams a binary file object into the store.
+
+        Returns:
+            str: Name of the stored object (`<digest><ext>`).
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f"upload.tmp-{os.getpid()}-{id(source)}"
+        digest = hashlib.blake2b(digest_size=16)
+
+        source.seek(0)
+        with open(tmp_path, "wb") as tmp_file:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                tmp_file.write(chunk)
+        source.seek(0)
+
+        object_name = f"{digest.hexdigest()}{ext.lower()}"
+        object_path = self.object_path(object_name)
+        if object_path.exists():
+            os.remove(tmp_path)  # Already stored
+        else:
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, object_path)
+        return object_name
+
+    def link(self, object_name, alias_path):
+        """Points `alias_path` to a stored object, replacing what was there."""
+        alias_path = Path(alias_path)
+        alias_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = alias_path.with_name(f".{alias_path.name}.tmp")
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(self.object_path(object_name), tmp_path)
+        except OSError:
+            shutil.copyfile(self.object_path(object_name), tmp_path)
+        os.replace(tmp_path, alias_path)
+
+    def add(self, source, alias_path):
+        """Stores an upload and links it as `alias_path`. Returns the object name."""
+        object_name = self.put(source, os.path.splitext(alias_path)[1])
+        self.link(object_name, alias_path)
+        return object_name
+
+    def release(self, object_name):
+        """Deletes a stored object once no alias links to it anymore."""
+        object_path = self.object_path(object_name)
+        try:
+            if os.stat(object_path).st_nlink <= 1:
+                os.remove(object_path)
+        except FileNotFoundError:
+            pass
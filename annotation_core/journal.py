@@ -0,0 +1,159 @@
+import csv
+import glob
+import os
+import threading
+import time
+from pathlib import Path
+
+from .atomic import atomic_write_many
+from .loader import MalformedRow
+
+JOURNAL_SUFFIX = ".journal"
+
+# Compact after this many journaled changes, or this many seconds after the last compaction
+COMPACT_EVERY = 500
+COMPACT_INTERVAL = 120
+
+
+class AnnotationJournal:
+    """
+    Append-only write-ahead log of the annotation changes of one image.
+
+    Every change is appended to `<image>.journal`, next to the canonical
+    `<image>.csv`. Compaction first seals the journal (renames it to
+    `<image>.journal.<stamp>`, so new changes go to a fresh file), then
+    rewrites the CSV from a snapshot of the store and deletes the sealed
+    segments. Readers rebuild the current state by replaying the sealed
+    segments and the journal on top of the last CSV snapshot. Entries are
+    idempotent ("set" and "remove"), so replaying a segment that was already
+    compacted is harmless.
+    """
+
+    def __init__(self, csv_path, label_list, compact_every=COMPACT_EVERY, compact_interval=COMPACT_INTERVAL):
+        self.csv_path = Path(csv_path)
+        self.path = self.csv_path.with_suffix(JOURNAL_SUFFIX)
+        self.label_list = label_list
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self.pending = 0
+        self.last_compaction = time.monotonic()
+        self.malformed = {}  # path -> MalformedRow skipped by the last replay
+        self._tail_checked = False
+        self._lock = threading.Lock()
+
+    def _segments(self):
+        """Sealed segments waiting for compaction, oldest first."""
+        return sorted(glob.glob(glob.escape(str(self.path)) + ".*"))
+
+    def append(self, delta):
+        """Appends the changes of an `AnnotationDelta` to the journal."""
+        rows = []
+        rows.extend(["remove", x, y, self.label_list[label_id]] for x, y, label_id in delta.removed.tolist())
+        rows.extend(["set", x, y, self.label_list[label_id]] for x, y, label_id in delta.relabeled.tolist())
+        rows.extend(["set", x, y, self.label_list[label_id]] for x, y, label_id in delta.added.tolist())
+        if not rows:
+            return
+
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8", newline="") as journal_file:
+                if not self._tail_checked:
+                    # A line torn by a crash must not swallow the first new row
+                    if journal_file.tell() > 0 and not self._ends_with_newline():
+                        journal_file.write("\n")
+                    self._tail_checked = True
+                csv.writer(journal_file).writerows(rows)
+            self.pending += len(rows)
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as journal_file:
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) == b"\n"
+
+    def replay(self, store):
+        """
+        Applies the journaled changes on top of `store`, in place. Rows that
+        cannot be applied (a line torn by a crash, or a label that is no
+        longer in the label list) are skipped and recorded in `malformed`.
+        """
+        label_ids = {label: idx for idx, label in enumerate(self.label_list)}
+        self.malformed = {}
+        for path in self._segments() + [str(self.path)]:
+            if not os.path.exists(path):
+                continue
+            with open(path, mode="r", encoding="utf-8", newline="") as journal_file:
+                for line, row in enumerate(csv.reader(journal_file), start=1):
+                    reason = self._check(row, label_ids)
+                    if reason is not None:
+                        if row:
+                            self.malformed.setdefault(path, []).append(MalformedRow(line, row, reason))
+                        continue
+                    op, x, y, label = row
+                    x, y = int(x), int(y)
+                    if op == "remove":
+                        store.remove(x, y)
+                    elif not store.relabel(x, y, label_ids[label]):
+                        store.add(x, y, label_ids[label])
+                    self.pending += 1
+        return store
+
+    @staticmethod
+    def _check(row, label_ids):
+        """Why a journal row cannot be applied, or None."""
+        if len(row) != 4:
+            return f"expected 4 fields, found {len(row)}"
+        op, x, y, label = row
+        if op not in ("set", "remove"):
+            return f"unknown operation '{op}'"
+        try:
+            int(x), int(y)
+        except ValueError:
+            return "coordinates are not integers"
+        if op == "set" and label not in label_ids:
+            return f"unknown label '{label}'"
+        return None
+
+    def needs_compaction(self):
+        if self.pending == 0:
+            return False
+        elapsed = time.monotonic() - self.last_compaction
+        return self.pending >= self.compact_every or elapsed >= self.compact_interval
+
+    def seal(self):
+        """
+        Moves the current journal to a sealed segment, so changes appended
+        from now on are not removed by the compaction of an earlier snapshot.
+
+        Returns:
+            str | None: Path of the sealed segment, or None if there was nothing to seal.
+        """
+        with self._lock:
+            self.pending = 0
+            self.last_compaction = time.monotonic()
+            if not self.path.exists():
+                return None
+            sealed = f"{self.path}.{time.time_ns():020d}"
+            os.replace(self.path, sealed)
+            return sealed
+
+    def compact(self, store, sealed, save=None, files=()):
+        """
+        Writes the canonical CSV from `store` and deletes the sealed segments
+        it covers. `sealed` is the value returned by `seal`, and `store` must
+        include every change journaled before it was sealed. `save(store)`
+        replaces the CSV when the snapshot is kept somewhere else. `files`
+        are (path, data) pairs written in the same commit as the CSV (see
+        `atomic_write_many`).
+        """
+        files = list(files)
+        if save is not None:
+            save(store)
+        else:
+            # Segments are only deleted once the CSV that covers them is in place
+            files.insert(0, (self.csv_path, store.to_csv(self.label_list)))
+        atomic_write_many(files)
+
+        if sealed is not None:
+            for segment in self._segments():
+                if segment <= sealed:
+                    os.remove(segment)
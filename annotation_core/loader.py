@@ -0,0 +1,178 @@
+import csv
+from collections import defaultdict
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from .diff import point_keys
+from .store import PointStore
+
+HEADER = ("X", "Y", "Label")
+
+
+class MalformedRow(NamedTuple):
+    """Row of an annotation CSV that could not be loaded."""
+    line: int  # 1-based line number in the file
+    row: list
+    reason: str
+
+
+class LoadedAnnotations(NamedTuple):
+    store: PointStore
+    malformed: list  # MalformedRow
+
+
+def _parse_ints(values):
+    """
+    Converts a column of strings to int64 in one pass. Returns the column
+    and a mask of the values that are not integers (those are set to 0).
+    """
+    try:
+        return np.fromiter(map(int, values), dtype=np.int64, count=len(values)), np.zeros(len(values), dtype=bool)
+    except ValueError:
+        pass
+
+    # Slow path, only for files with bad values
+    invalid = np.zeros(len(values), dtype=bool)
+    parsed = np.zeros(len(values), dtype=np.int64)
+    for idx, value in enumerate(values):
+        try:
+            parsed[idx] = int(value)
+        except ValueError:
+            invalid[idx] = True
+    return parsed, invalid
+
+
+def _read_frame(csv_path, label_list):
+    """
+    Parses a well-formed annotation CSV with pandas and converts its columns
+    in bulk. Returns None when any row needs the row-by-row diagnosis of
+    `_read_rows` (wrong number of fields, blank lines, values that are not
+    integers, unknown labels).
+    """
+    try:
+        frame = pd.read_csv(csv_path, dtype=str, na_filter=False, skip_blank_lines=False, encoding="utf-8-sig")
+    except pd.errors.EmptyDataError:
+        return [], None
+    except (pd.errors.ParserError, UnicodeDecodeError):
+        return None
+
+    header = [str(name).strip() for name in frame.columns]
+    raw = _columns(csv_path, header, list(frame.columns))
+    try:
+        x = frame[raw[0]].to_numpy().astype(np.int64)
+        y = frame[raw[1]].to_numpy().astype(np.int64)
+    except ValueError:
+        return None
+    labels = pd.Index(label_list).get_indexer(frame[raw[2]]).astype(np.int64)
+    if (labels < 0).any():
+        return None
+
+    lines = np.arange(2, len(frame) + 2)
+    return [], (x, y, labels, lines, frame.to_numpy())
+
+
+def _read_rows(csv_path, label_list):
+    """Parses an annotation CSV row by row, reporting the rows that cannot be loaded."""
+    with open(csv_path, mode="r", encoding="utf-8", newline="") as csv_file:
+        rows = list(csv.reader(csv_file))
+
+    if not rows:
+        return [], None
+
+    header = [name.strip().lstrip("\ufeff") for name in rows[0]]
+    ix, iy, il = (header.index(name) for name in _columns(csv_path, header, rows[0]))
+
+    malformed = []
+    body = rows[1:]
+    lines = np.arange(2, len(body) + 2)
+
+    # Rows with the wrong number of fields (blank lines are ignored)
+    width = len(header)
+    lengths = np.fromiter(map(len, body), dtype=np.int64, count=len(body))
+    complete = lengths == width
+    for idx in np.flatnonzero(~complete & (lengths > 0)).tolist():
+        malformed.append(MalformedRow(int(lines[idx]), body[idx], f"expected {width} fields, found {lengths[idx]}"))
+    if not complete.all():
+        body = [row for row, ok in zip(body, complete.tolist()) if ok]
+        lines = lines[complete]
+
+    x, bad_x = _parse_ints([row[ix] for row in body])
+    y, bad_y = _parse_ints([row[iy] for row in body])
+
+    # Precomputed label -> id map; unknown labels map to -1
+    label_ids = defaultdict(lambda: -1, {label: idx for idx, label in enumerate(label_list)})
+    labels = np.fromiter(map(label_ids.__getitem__, [row[il] for row in body]), dtype=np.int64, count=len(body))
+    bad_label = labels < 0
+
+    invalid = bad_x | bad_y | bad_label
+    for idx in np.flatnonzero(invalid).tolist():
+        row = body[idx]
+        if bad_label[idx]:
+            reason = f"unknown label '{row[il]}'"
+        else:
+            reason = "coordinates are not integers"
+        malformed.append(MalformedRow(int(lines[idx]), row, reason))
+
+    valid = np.flatnonzero(~invalid)
+    rows = [body[idx] for idx in valid.tolist()]
+    return malformed, (x[valid], y[valid], labels[valid], lines[valid], rows)
+
+
+def _columns(csv_path, header, found):
+    """Names in `header` of the X, Y and Label columns, in that order."""
+    try:
+        return [found[header.index(name)] for name in HEADER]
+    except ValueError:
+        raise ValueError(f"'{csv_path}' does not have the columns {', '.join(HEADER)} (found {found})") from None
+
+
+def load_annotation_csv(csv_path, label_list):
+    """
+    Loads an annotation CSV (X, Y, Label) into a `PointStore`.
+
+    Well-formed files are parsed by pandas and converted column-wise into
+    NumPy arrays, with the labels mapped through an index instead of a
+    `label_list.index` search per row. Files with rows that cannot be loaded
+    are parsed again row by row: rows with the wrong number of fields, non
+    integer coordinates or unknown labels are skipped and reported. When a
+    coordinate is repeated the last row wins, and the earlier ones are
+    reported too.
+
+    Args:
+        csv_path (str): Path to the CSV file.
+        label_list (list): Label names, indexed by label id.
+
+    Returns:
+        LoadedAnnotations: The store and the malformed rows.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        ValueError: If the header does not have the X, Y and Label columns.
+    """
+    parsed = _read_frame(csv_path, label_list)
+    if parsed is None:
+        parsed = _read_rows(csv_path, label_list)
+    malformed, columns = parsed
+    if columns is None:
+        return LoadedAnnotations(PointStore(), malformed)
+    x, y, labels, lines, rows = columns
+
+    # Repeated coordinates: keep the last row of each, as the store used to
+    keys = point_keys(x, y)
+    unique_keys, last = np.unique(keys[::-1], return_index=True)
+    if len(unique_keys) != len(keys):
+        last = np.sort(len(keys) - 1 - last)
+        last_line = dict(zip(keys[last].tolist(), lines[last].tolist()))
+        replaced = np.ones(len(keys), dtype=bool)
+        replaced[last] = False
+        for idx in np.flatnonzero(replaced).tolist():
+            malformed.append(MalformedRow(
+                int(lines[idx]), list(rows[idx]), f"duplicate coordinates, replaced by line {last_line[int(keys[idx])]}"
+            ))
+        x, y, labels = x[last], y[last], labels[last]
+
+    store = PointStore.from_columns(x, y, labels)
+    malformed.sort(key=lambda entry: entry.line)
+    return LoadedAnnotations(store, malformed)
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from .atomic import atomic_write_many
+
+MANIFEST_FILE = "manifest.json"
+
+
+class ImageManifest:
+    """
+    Index of the images of one annotator and of their annotation and report
+    files, so checking whether an image exists does not list its folder.
+
+    The index is kept in memory and persisted to `<data_dir>/manifest.json`
+    whenever it changes. On load it is trusted as long as the modification
+    time of the image folder still matches the one recorded with it;
+    otherwise the folders are scanned once and the manifest is written
+    again. The annotation folder is not checked, since the journals change
+    it on every session, so the 'annotations' and 'report' flags only
+    record what was written through the manifest.
+    """
+
+    def __init__(self, data_dir, image_dir, ann_dir, report_dir):
+        self.path = Path(data_dir) / MANIFEST_FILE
+        self.dirs = {"image": Path(image_dir), "annotations": Path(ann_dir), "report": Path(report_dir)}
+        self._entries = {}  # base name -> {'image', 'object', 'bytes', 'opened', 'pinned', 'annotations', 'report'}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _image_dir_mtime(self):
+        try:
+            return os.stat(self.dirs["image"]).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get("image_dir_mtime") == self._image_dir_mtime():
+                self._entries = manifest["entries"]
+                return
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        self.rebuild()
+
+    def rebuild(self):
+        """Scans the folders and writes the manifest again."""
+        entries = {}
+
+        def scan(directory):
+            try:
+                with os.scandir(directory) as it:
+                    return [entry for entry in it if entry.is_file() and not entry.name.startswith(".")]
+            except FileNotFoundError:
+                return []
+
+        # Images opened before the manifest existed are ranked by modification time
+        for file in scan(self.dirs["image"]):
+            stat = file.stat()
+            entries[os.path.splitext(file.name)[0]] = {
+                "image": file.name, "bytes": stat.st_size, "opened": stat.st_mtime, "annotations": False, "report": False
+            }
+        for file in scan(self.dirs["annotations"]):
+            base_name, ext = os.path.splitext(file.name)
+            if ext == ".csv" and base_name in entries:
+                entries[base_name]["annotations"] = True
+        for file in scan(self.dirs["report"]):
+            base_name, ext = os.path.splitext(file.name)
+            if ext == ".txt" and base_name in entries:
+                entries[base_name]["report"] = True
+
+        with self._lock:
+            self._entries = entries
+            self._save()
+
+    def _save(self, files=()):
+        # Called with the lock held. `files` are (path, data) pairs committed with the manifest
+        manifest = json.dumps({"image_dir_mtime": self._image_dir_mtime(), "entries": self._entries})
+        atomic_write_many([(self.path, manifest), *files])
+
+    def has_image(self, image_file_name):
+        """True if an image with the base name of `image_file_name` (any extension) is stored."""
+        return os.path.splitext(image_file_name)[0] in self._entries
+
+    def get(self, base_name):
+        """Entry of an image, or None: {'image', 'object', 'bytes', 'opened', 'pinned', 'annotations', 'report'}."""
+        return self._entries.get(base_name)
+
+    def entries(self):
+        """Copy of the entries, by base name."""
+        with self._lock:
+            return {base_name: dict(entry) for base_name, entry in self._entries.items()}
+
+    def add_image(self, image_file_name, object_name=None, files=()):
+        """
+        Records an image, after it was saved to the image folder.
+        `object_name` is the stored object it links to, if any (see `ImageStore`).
+        `files` are (path, data) pairs written in the same commit as the manifest.
+        """
+        with self._lock:
+            base_name = os.path.splitext(image_file_name)[0]
+            entry = self._entries.setdefault(base_name, {"image": image_file_name, "annotations": False, "report": False})
+            entry["image"] = image_file_name
+            entry["object"] = object_name
+            entry["opened"] = time.time()
+            try:
+                entry["bytes"] = os.stat(self.dirs["image"] / image_file_name).st_size
+            except FileNotFoundError:
+                entry["bytes"] = 0
+            self._save(files)
+
+    def touch(self, base_name, files=()):
+        """
+        Records that an image was opened again. `files` are (path, data)
+        pairs written in the same commit as the manifest.
+        """
+        with self._lock:
+            entry = self._entries.get(base_name)
+            if entry is not None:
+                entry["opened"] = time.time()
+                self._save(files)
+            else:
+                atomic_write_many(files)
+
+    def pin(self, base_name, pinned=True):
+        """Pinned images are never deleted by the retention policy."""
+        with self._lock:
+            entry = self._entries.get(base_name)
+            if entry is not None and bool(entry.get("pinned")) != pinned:
+                entry["pinned"] = pinned
+                self._save()
+
+    def add_results(self, base_name):
+        """Records that the annotation CSV and the report of an image were written."""
+        with self._lock:
+            entry = self._entries.get(base_name)
+            if entry is None or (entry["annotations"] and entry["report"]):
+                return
+            entry["annotations"] = entry["report"] = True
+            self._save()
+
+    def discard(self, base_names):
+        """Removes images (and their results) from the index, after they were deleted."""
+        with self._lock:
+            for base_name in base_names:
+                self._entries.pop(base_name, None)
+            self._save()
@@ -0,0 +1,70 @@
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+from .retention import RetentionPolicy
+
+
+def positive_negative_report(label_list, store, file_name):
+    """Report with the positive and negative counts (first two labels)."""
+
+    # **Generate the Annotation Report**
+    class_counts = store.class_counts(len(label_list))
+    num_positive = int(class_counts[0])
+    num_negative = int(class_counts[1])
+
+    total = num_positive + num_negative
+
+    if total==0:
+        total = -1
+
+    report_content = f"""
+    Reporte de anotación
+    ==================
+    Nombre de la imagen: {file_name}
+    Número de puntos positivos: {num_positive} - Porcentaje: {100*num_positive/total}%
+    Número de puntos negativos: {num_negative} - Porcentaje: {100*num_negative/total}%
+    Cantidad total de elementos {total}
+    """
+
+    return report_content
+
+
+def fixed_point_style(image_size):
+    """Point radius and outline width of the annotated image, in pixels."""
+    return 7.5, 5
+
+
+class Marker(NamedTuple):
+    """
+    Definition of one annotator (HER2, KI67, ...): everything the shared
+    annotator engine needs to know about a marker.
+
+    - `build_report(label_list, store, file_name)` returns the text report.
+    - `point_style(image_size)` returns the point radius and outline width
+      used on the annotated image.
+    - `color_legend` shows the label colors in the sidebar and uses them on
+      the canvas.
+    - `retention` is the `RetentionPolicy` that the janitor applies to the
+      stored images (None keeps every file).
+    """
+    name: str
+    label_list: list
+    label_colors: dict
+    data_dir: Path
+    log_file: Path
+    build_report: Callable = positive_negative_report
+    point_style: Callable = fixed_point_style
+    color_legend: bool = False
+    retention: Optional[RetentionPolicy] = None
+
+    @property
+    def image_dir(self):
+        return self.data_dir / "images"
+
+    @property
+    def ann_dir(self):
+        return self.data_dir / "annotations"
+
+    @property
+    def report_dir(self):
+        return self.data_dir / "reports"
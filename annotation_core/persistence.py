@@ -0,0 +1,84 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Opt-in: ANNOTATOR_ASYNC_PERSISTENCE=1 writes results from a background pool
+ASYNC_PERSISTENCE = os.environ.get("ANNOTATOR_ASYNC_PERSISTENCE", "0") == "1"
+MAX_WORKERS = int(os.environ.get("ANNOTATOR_PERSISTENCE_WORKERS", "2"))
+
+
+class PersistenceWorker:
+    """
+    Per-process pool that runs persistence jobs outside the Streamlit script
+    thread.
+
+    Jobs are coalesced by key: while a job for a key is waiting, submitting
+    another one for the same key replaces it, so only the newest state of an
+    image is written. Jobs for the same key never run concurrently and run in
+    submission order.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="annotation-persistence")
+        self._cond = threading.Condition()
+        self._pending = {}  # key -> (fn, args)
+        self._running = set()
+
+    def submit(self, key, fn, *args):
+        with self._cond:
+            scheduled = key in self._pending or key in self._running
+            self._pending[key] = (fn, args)
+            if not scheduled:
+                self._executor.submit(self._run, key)
+
+    def _run(self, key):
+        while True:
+            with self._cond:
+                job = self._pending.pop(key, None)
+                if job is None:
+                    self._running.discard(key)
+                    self._cond.notify_all()
+                    return
+                self._running.add(key)
+
+            fn, args = job
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Error in persistence job '{key}': {e}")
+
+    def flush(self, timeout=None):
+        """Waits until every submitted job has run. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._running, timeout)
+
+    def shutdown(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    """Returns the process-wide worker, flushed when the interpreter exits."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = PersistenceWorker()
+            atexit.register(_worker.shutdown)
+        return _worker
+
+
+def persist(key, fn, *args):
+    """
+    Runs a persistence job inline, or on the background worker when
+    `ASYNC_PERSISTENCE` is enabled. Arguments must not be modified by the
+    caller afterwards (pass `PointStore.snapshot()` rather than the store).
+    """
+    if ASYNC_PERSISTENCE:
+        get_worker().submit(key, fn, *args)
+    else:
+        fn(*args)
@@ -0,0 +1,179 @@
+import numpy as np
+
+from .diff import AnnotationDelta, diff_points
+
+
+def new_sync_state(oplog=False):
+    """
+    State kept per image to follow the operation log sent by the canvas.
+
+    - `client`: id of the frontend instance whose operations are being applied.
+    - `seq`: sequence number of the last operation applied to the store.
+    - `push`: send the full point list to the frontend on the next render.
+    - `resync`: ask the frontend to send its full point list back.
+    - `oplog`: the canvas said it speaks the operation log. Until then it is
+      treated as an older build, which needs the full point list on every
+      render (see `pointdet`).
+    """
+    return {'client': None, 'seq': 0, 'push': True, 'resync': False, 'oplog': oplog}
+
+
+def _pixel(point):
+    return int(round(point[0])), int(round(point[1]))
+
+
+def _apply_full(store, points):
+    if isinstance(points, dict):
+        # Columns: {'x': [...], 'y': [...], 'label_id': [...]}
+        x, y, label_ids = points['x'], points['y'], points['label_id']
+    else:
+        # List of {'point': [x, y], 'label_id'} (older frontend builds)
+        coords = np.array([v['point'] for v in points], dtype=float).reshape(-1, 2)
+        x, y = coords[:, 0], coords[:, 1]
+        label_ids = [v['label_id'] for v in points]
+
+    x = np.rint(np.asarray(x, dtype=float)).astype(np.int64)
+    y = np.rint(np.asarray(y, dtype=float)).astype(np.int64)
+    label_ids = np.asarray(label_ids, dtype=np.int64)
+
+    delta = diff_points(store, x, y, label_ids)
+    store.apply(delta)
+    return delta
+
+
+def _apply_ops(store, ops):
+    # Label of every touched coordinate before the batch, to report the net change
+    before = {}
+    # An add or a move onto a pixel that is already annotated is not applied:
+    # the canvas then shows a point the store does not have
+    conflict = False
+
+    def touch(x, y):
+        if (x, y) not in before:
+            before[(x, y)] = store.label_of(x, y)
+
+    for op in ops:
+        x, y = _pixel(op['point'])
+        kind = op['op']
+
+        if kind == 'add':
+            touch(x, y)
+            conflict |= not store.add(x, y, op['label_id'])
+        elif kind == 'delete':
+            touch(x, y)
+            store.remove(x, y)
+        elif kind == 'relabel':
+            touch(x, y)
+            store.relabel(x, y, op['label_id'])
+        elif kind == 'move':
+            from_x, from_y = _pixel(op['from'])
+            if (x, y) == (from_x, from_y):
+                continue
+            if (x, y) in store:
+                # Checked before removing, so the moved point is kept where it was
+                conflict = True
+                continue
+            touch(from_x, from_y)
+            touch(x, y)
+            label_id = store.remove(from_x, from_y)
+            if label_id is not None:
+                store.add(x, y, label_id)
+
+    added, removed, relabeled = [], [], []
+    for (x, y), old_label in before.items():
+        new_label = store.label_of(x, y)
+        if old_label is None and new_label is not None:
+            added.append((x, y, new_label))
+        elif old_label is not None and new_label is None:
+            removed.append((x, y, old_label))
+        elif old_label != new_label:
+            relabeled.append((x, y, new_label))
+
+    delta = AnnotationDelta(
+        added=np.array(added, dtype=np.int64).reshape(-1, 3),
+        removed=np.array(removed, dtype=np.int64).reshape(-1, 3),
+        relabeled=np.array(relabeled, dtype=np.int64).reshape(-1, 3),
+    )
+    return delta, conflict
+
+
+def apply_component_value(store, value, sync):
+    """
+    Applies a value returned by `pointdet` to the store.
+
+    The canvas sends `{'client', 'seq', 'ops'}` with the operations that were
+    not acknowledged yet, `{'client', 'seq', 'full'}` with every point (as
+    `x`, `y` and `label_id` columns) when it was asked to resynchronize, and
+    `{'client', 'seq': 0, 'hello': True, 'oplog': True, 'has_points'}` when
+    it is mounted. A plain list is the full point list sent by older builds
+    of the frontend, which leave `sync['oplog']` off. Operations that were
+    already applied are skipped, so the same value can be passed on every
+    rerun.
+
+    When the operation log cannot be followed (an unknown client, or a gap in
+    the sequence numbers) `sync['push']` or `sync['resync']` is set and the
+    caller should rerun the script so the frontend gets the request.
+
+    Args:
+        store (PointStore): Current annotations. Updated in place.
+        value (dict | list | None): Value returned by `pointdet`.
+        sync (dict): State created by `new_sync_state`. Updated in place.
+
+    Returns:
+        tuple: A tuple containing:
+            - delta (AnnotationDelta): The points that were added, removed or relabeled.
+            - rerun (bool): True if a resynchronization was just requested.
+    """
+    push, resync = sync['push'], sync['resync']
+    delta = _apply_value(store, value, sync)
+    rerun = (sync['push'] and not push) or (sync['resync'] and not resync)
+    return delta, rerun
+
+
+def _apply_value(store, value, sync):
+    if value is None:
+        return AnnotationDelta.empty()
+
+    if isinstance(value, list):
+        return _apply_full(store, value)
+
+    client = value['client']
+    seq = value['seq']
+
+    # Only canvases that speak the operation log answer with a dictionary:
+    # push the points again, in the format they expect
+    if not sync['oplog']:
+        sync.update({'oplog': True, 'push': True})
+
+    if 'full' in value:
+        if client == sync['client'] and seq <= sync['seq']:
+            return AnnotationDelta.empty()
+        sync.update({'client': client, 'seq': seq, 'resync': False})
+        return _apply_full(store, value['full'])
+
+    if value.get('hello'):
+        if client != sync['client']:
+            sync.update({'client': client, 'seq': seq})
+            if not value.get('has_points'):
+                sync['push'] = True
+        return AnnotationDelta.empty()
+
+    if client != sync['client']:
+        # A new canvas that started from the points we rendered
+        sync.update({'client': client, 'seq': 0})
+
+    ops = [op for op in value['ops'] if op['seq'] > sync['seq']]
+    if not ops:
+        return AnnotationDelta.empty()
+
+    if ops[0]['seq'] != sync['seq'] + 1:
+        # Some operations were lost (e.g. the session was recovered)
+        sync['resync'] = True
+        return AnnotationDelta.empty()
+
+    sync['seq'] = ops[-1]['seq']
+    delta, conflict = _apply_ops(store, ops)
+    if conflict:
+        # Send the store back so the canvas drops the points it could not take
+        sync['push'] = True
+    return delta
@@ -0,0 +1,87 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .diff import diff_points
+from .store import PointStore
+
+
+class AnnotationRenderer:
+    """
+    Keeps the annotated image of one session up to date incrementally.
+
+    The base image is converted to RGB once, and points are drawn on a
+    separate transparent layer. `update` diffs the store against the points
+    already drawn and only draws the new points; removed or relabeled points
+    are erased by clearing their box on the layer and redrawing the
+    neighbours that overlap it. The PNG is composed and encoded on `encode`,
+    and cached until the annotations change.
+    """
+
+    def __init__(self, image, label_colors, point_radius, outline_width):
+        self.base = image.convert("RGB")
+        self.base.info.pop("icc_profile", None)
+        self.layer = Image.new("RGBA", self.base.size, (0, 0, 0, 0))
+        self.label_colors = label_colors
+        self.point_radius = point_radius
+        self.outline_width = outline_width
+
+        self._draw = ImageDraw.Draw(self.layer)
+        self._drawn = PointStore()
+        self._png = None
+        self._png_version = None
+        self._lock = threading.Lock()
+
+    def _box(self, x, y):
+        r = self.point_radius
+        return [(x - r, y - r), (x + r, y + r)]
+
+    def _draw_point(self, x, y, label_id):
+        color = self.label_colors.get(label_id, (255, 255, 255))  # Default to white if label not found
+        self._draw.ellipse(self._box(x, y), outline=color, width=self.outline_width)
+
+    def _erase(self, points):
+        if len(points) == 0:
+            return
+
+        r = int(np.ceil(self.point_radius)) + 1
+        for x, y in points.tolist():
+            self.layer.paste((0, 0, 0, 0), (x - r, y - r, x + r + 1, y + r + 1))
+
+        # Redraw the remaining points whose outline overlapped an erased box
+        xs = self._drawn.x.astype(np.int64)
+        ys = self._drawn.y.astype(np.int64)
+        labels = self._drawn.labels
+        overlap = np.zeros(len(xs), dtype=bool)
+        for x, y in points.tolist():
+            overlap |= (np.abs(xs - x) <= 2 * r) & (np.abs(ys - y) <= 2 * r)
+        for x, y, label_id in zip(xs[overlap].tolist(), ys[overlap].tolist(), labels[overlap].tolist()):
+            self._draw_point(x, y, label_id)
+
+    def update(self, store):
+        """Brings the annotation layer in line with `store` (a store or a snapshot)."""
+        with self._lock:
+            delta = diff_points(self._drawn, store.x, store.y, store.labels)
+            if not delta:
+                return
+
+            self._drawn.apply(delta)
+
+            self._erase(np.concatenate((delta.removed[:, :2], delta.relabeled[:, :2])))
+            for x, y, label_id in np.concatenate((delta.relabeled, delta.added)).tolist():
+                self._draw_point(x, y, label_id)
+
+    def encode(self, image_format="PNG"):
+        """Annotated image as encoded bytes, cached until the annotations change."""
+        with self._lock:
+            if self._png is None or self._png_version != self._drawn.version:
+                ann_image = self.base.copy()
+                ann_image.paste(self.layer, mask=self.layer)
+
+                image_buffer = io.BytesIO()
+                ann_image.save(image_buffer, format=image_format)
+                self._png = image_buffer.getvalue()
+                self._png_version = self._drawn.version
+            return self._png
@@ -0,0 +1,173 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .loader import load_annotation_csv
+from .store import PointStore
+
+# Opt-in: ANNOTATOR_STORAGE=sqlite keeps the annotations in <data_dir>/annotations.db
+# instead of one CSV per image
+STORAGE_BACKEND = os.environ.get("ANNOTATOR_STORAGE", "csv").lower()
+DATABASE_FILE = "annotations.db"
+
+# Identity recorded with every saved annotation
+ANNOTATOR_USER = os.environ.get("ANNOTATOR_USER") or None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    file_name TEXT,
+    width INTEGER,
+    height INTEGER,
+    annotator TEXT,
+    num_points INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS points (
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    label_id INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS points_image ON points (image_id, x, y);
+CREATE INDEX IF NOT EXISTS points_label ON points (label_id, image_id);
+"""
+
+
+class SqliteRepository:
+    """
+    Annotations of one marker in an embedded SQLite database.
+
+    Images are keyed by their base name (the name of their CSV), with their
+    file name, size, annotator and last update. Points are stored with their
+    label id, indexed by (image, x, y), and the label names are kept in their
+    own table so the label ids of every image can be resolved by queries.
+    A save replaces the points of an image in a single transaction.
+
+    CSV files stay the exchange format: `import_csv` loads the annotation CSV
+    written by the CSV backend, and `export_csv` returns the same format.
+    """
+
+    def __init__(self, path, label_list):
+        self.path = Path(path)
+        self.label_list = label_list
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+            connection.executemany(
+                "INSERT INTO labels (id, name) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET name = excluded.name",
+                enumerate(label_list)
+            )
+
+    def _connect(self):
+        # One connection per thread: saves can run on the persistence worker
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA foreign_keys = ON")
+            self._local.connection = connection
+        return connection
+
+    def _image_id(self, connection, name):
+        connection.execute("INSERT INTO images (name) VALUES (?) ON CONFLICT (name) DO NOTHING", (name,))
+        return connection.execute("SELECT id FROM images WHERE name = ?", (name,)).fetchone()[0]
+
+    def register_image(self, name, file_name, width, height):
+        """Records the image file behind `name` and its size."""
+        with self._connect() as connection:
+            image_id = self._image_id(connection, name)
+            connection.execute(
+                "UPDATE images SET file_name = ?, width = ?, height = ? WHERE id = ?",
+                (file_name, width, height, image_id)
+            )
+
+    def save(self, name, store, annotator=ANNOTATOR_USER):
+        """Replaces the points of image `name` with the ones of `store`."""
+        with self._connect() as connection:
+            image_id = self._image_id(connection, name)
+            connection.execute("DELETE FROM points WHERE image_id = ?", (image_id,))
+            connection.executemany(
+                "INSERT INTO points (image_id, x, y, label_id) VALUES (?, ?, ?, ?)",
+                zip([image_id] * len(store), store.x.tolist(), store.y.tolist(), store.labels.tolist())
+            )
+            connection.execute(
+                "UPDATE images SET annotator = COALESCE(?, annotator), num_points = ?, updated_at = ? WHERE id = ?",
+                (annotator, len(store), time.time(), image_id)
+            )
+
+    def load(self, name):
+        """
+        Returns the `PointStore` of image `name`, or None if it was never
+        saved. Points keep the order of the last save.
+        """
+        connection = self._connect()
+        row = connection.execute("SELECT id FROM images WHERE name = ? AND updated_at IS NOT NULL", (name,)).fetchone()
+        if row is None:
+            return None
+
+        rows = connection.execute(
+            "SELECT x, y, label_id FROM points WHERE image_id = ? ORDER BY rowid", (row[0],)
+        ).fetchall()
+        columns = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        return PointStore.from_columns(columns[:, 0], columns[:, 1], columns[:, 2])
+
+    def delete(self, names):
+        """Deletes images and their points."""
+        with self._connect() as connection:
+            connection.executemany("DELETE FROM images WHERE name = ?", [(name,) for name in names])
+
+    def import_csv(self, name, csv_path, annotator=ANNOTATOR_USER):
+        """
+        Loads an annotation CSV (X, Y, Label) into image `name`.
+
+        Returns:
+            LoadedAnnotations: The imported points and the rows that were skipped.
+        """
+        loaded = load_annotation_csv(csv_path, self.label_list)
+        self.save(name, loaded.store, annotator)
+        return loaded
+
+    def export_csv(self, name):
+        """Annotation CSV (X, Y, Label) of image `name`, or None if it was never saved."""
+        store = self.load(name)
+        if store is None:
+            return None
+        return store.to_csv(self.label_list)
+
+    def image_names(self):
+        """Names of the annotated images, most recently updated first."""
+        rows = self._connect().execute(
+            "SELECT name FROM images WHERE updated_at IS NOT NULL ORDER BY updated_at DESC"
+        )
+        return [name for name, in rows]
+
+    def class_counts(self):
+        """
+        Number of points per label of every annotated image.
+
+        Returns:
+            dict: image name -> {label name: count}.
+        """
+        counts = {}
+        rows = self._connect().execute(
+            "SELECT images.name, labels.name, COUNT(*) FROM points"
+            " JOIN images ON images.id = points.image_id"
+            " JOIN labels ON labels.id = points.label_id"
+            " GROUP BY points.image_id, points.label_id"
+        )
+        for image_name, label, count in rows:
+            counts.setdefault(image_name, dict.fromkeys(self.label_list, 0))[label] = count
+        return counts
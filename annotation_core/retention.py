@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+# Seconds between the periodic sweeps of the janitor
+JANITOR_INTERVAL = float(os.environ.get("ANNOTATOR_JANITOR_INTERVAL", "300"))
+
+# An image counts as open, and is never deleted, while a session has used it within this many seconds
+ACTIVE_TIMEOUT = float(os.environ.get("ANNOTATOR_ACTIVE_TIMEOUT", "900"))
+
+
+class RetentionPolicy(NamedTuple):
+    """
+    Which images of a marker are kept. Images are ranked by the last time
+    they were opened; every limit that is not None applies, and pinned or
+    open images are always kept.
+
+    - `keep_recent`: number of most recently opened images kept.
+    - `max_age_days`: images not opened for longer are deleted.
+    - `max_bytes`: total size of the stored images kept.
+    """
+    keep_recent: Optional[int] = None
+    max_age_days: Optional[float] = None
+    max_bytes: Optional[int] = None
+
+    def expired(self, entries, active, now=None):
+        """
+        Selects the images to delete.
+
+        Args:
+            entries (dict): Manifest entries, by base name.
+            active (set): Base names of the images open in a session.
+            now (float, optional): Current time, in seconds since the epoch.
+
+        Returns:
+            list: Base names of the images to delete, oldest first.
+        """
+        now = time.time() if now is None else now
+        ranked = sorted(entries.items(), key=lambda item: item[1].get("opened", 0), reverse=True)
+
+        expired = []
+        kept_bytes = 0
+        for rank, (base_name, entry) in enumerate(ranked):
+            if entry.get("pinned") or base_name in active:
+                kept_bytes += entry.get("bytes", 0)
+                continue
+
+            too_many = self.keep_recent is not None and rank >= self.keep_recent
+            too_old = self.max_age_days is not None and now - entry.get("opened", 0) > self.max_age_days * 86400
+            too_big = self.max_bytes is not None and kept_bytes + entry.get("bytes", 0) > self.max_bytes
+            if too_many or too_old or too_big:
+                expired.append(base_name)
+            else:
+                kept_bytes += entry.get("bytes", 0)
+
+        expired.reverse()
+        return expired
+
+
+class Janitor:
+    """
+    Background thread that applies the retention policies, so switching
+    images never waits for cleanup. Annotators ask for a sweep with
+    `request`; besides those, every annotator that asked once is swept
+    again every `interval` seconds, for the age limits, until it is
+    removed with `forget`.
+    """
+
+    def __init__(self, interval=JANITOR_INTERVAL):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._pending = []
+        self._known = []
+        self._thread = None
+
+    def request(self, annotator):
+        with self._cond:
+            if annotator not in self._known:
+                self._known.append(annotator)
+            if annotator not in self._pending:
+                self._pending.append(annotator)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="annotation-janitor", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def forget(self, annotator):
+        """Stops sweeping an annotator that is no longer used."""
+        with self._cond:
+            if annotator in self._known:
+                self._known.remove(annotator)
+            if annotator in self._pending:
+                self._pending.remove(annotator)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending, timeout=self.interval)
+                batch = self._pending or list(self._known)
+                self._pending = []
+
+            for annotator in batch:
+                try:
+                    annotator.collect_garbage()
+                except Exception as e:
+                    print(f"Error applying the retention policy of '{annotator.marker.name}': {e}")
+
+
+janitor = Janitor()
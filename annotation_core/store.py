@@ -0,0 +1,211 @@
+import csv
+import hashlib
+import io
+
+import numpy as np
+
+
+class PointStore:
+    """
+    Canonical, array-backed container for the annotated points of one image.
+
+    Points live in three parallel NumPy columns (x, y and label id) plus a
+    dictionary that maps every coordinate to its row. The lists handed to
+    `pointdet`, the CSV rows and the class counts are all derived from these
+    columns on demand, so the session state holds a single copy of the
+    annotations.
+    """
+
+    def __init__(self, capacity=1024):
+        self._x = np.empty(capacity, dtype=np.int32)
+        self._y = np.empty(capacity, dtype=np.int32)
+        self._label = np.empty(capacity, dtype=np.int16)
+        self._size = 0
+        self._index = {}  # (x, y) key -> row
+        self.version = 0
+
+    @classmethod
+    def from_points(cls, points, labels):
+        """
+        Builds a store from a sequence of (x, y) points and their label ids.
+        Repeated coordinates keep the first label that was seen.
+        """
+        store = cls(capacity=max(len(points), 1024))
+        for (x, y), label_id in zip(points, labels):
+            store.add(x, y, label_id)
+        store.version = 0
+        return store
+
+    @classmethod
+    def from_columns(cls, x, y, labels):
+        """
+        Builds a store from coordinate and label id columns without a
+        per-point insert. Repeated coordinates keep the first label that was seen.
+        """
+        x = np.asarray(x, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+        labels = np.asarray(labels, dtype=np.int64)
+
+        keys = (x << 32) | (y & 0xFFFFFFFF)
+        _, first = np.unique(keys, return_index=True)
+        if len(first) != len(keys):
+            first.sort()
+            x, y, labels, keys = x[first], y[first], labels[first], keys[first]
+
+        size = len(keys)
+        store = cls(capacity=max(size, 1024))
+        store._x[:size] = x
+        store._y[:size] = y
+        store._label[:size] = labels
+        store._size = size
+        store._index = dict(zip(keys.tolist(), range(size)))
+        return store
+
+    @staticmethod
+    def _key(x, y):
+        # Same packing as `diff.point_keys`; y is masked so negative values don't collide
+        return (int(x) << 32) | (int(y) & 0xFFFFFFFF)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, point):
+        return self._key(*point) in self._index
+
+    def _grow(self, capacity):
+        self._x = np.resize(self._x, capacity)
+        self._y = np.resize(self._y, capacity)
+        self._label = np.resize(self._label, capacity)
+
+    # Column views (read-only, no copies)
+    @property
+    def x(self):
+        view = self._x[:self._size]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def y(self):
+        view = self._y[:self._size]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def labels(self):
+        view = self._label[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def label_of(self, x, y, default=None):
+        row = self._index.get(self._key(x, y))
+        if row is None:
+            return default
+        return int(self._label[row])
+
+    def add(self, x, y, label_id):
+        """Adds a point. Returns False if the coordinate is already annotated."""
+        key = self._key(x, y)
+        if key in self._index:
+            return False
+
+        if self._size == len(self._x):
+            self._grow(2 * len(self._x))
+
+        row = self._size
+        self._x[row] = x
+        self._y[row] = y
+        self._label[row] = label_id
+        self._index[key] = row
+        self._size += 1
+        self.version += 1
+        return True
+
+    def remove(self, x, y):
+        """Removes a point and returns its label id, or None if it was not stored."""
+        row = self._index.pop(self._key(x, y), None)
+        if row is None:
+            return None
+
+        label_id = int(self._label[row])
+
+        # Fill the hole with the last row so the columns stay contiguous
+        last = self._size - 1
+        if row != last:
+            self._x[row] = self._x[last]
+            self._y[row] = self._y[last]
+            self._label[row] = self._label[last]
+            self._index[self._key(self._x[row], self._y[row])] = row
+
+        self._size -= 1
+        self.version += 1
+        return label_id
+
+    def relabel(self, x, y, label_id):
+        """Changes the label of a stored point. Returns False if it was not stored."""
+        row = self._index.get(self._key(x, y))
+        if row is None:
+            return False
+        if self._label[row] != label_id:
+            self._label[row] = label_id
+            self.version += 1
+        return True
+
+    def apply(self, delta):
+        """Applies an `AnnotationDelta` to the store, in place."""
+        for x, y, _ in delta.removed.tolist():
+            self.remove(x, y)
+        for x, y, label_id in delta.relabeled.tolist():
+            self.relabel(x, y, label_id)
+        for x, y, label_id in delta.added.tolist():
+            self.add(x, y, label_id)
+
+    def snapshot(self):
+        """
+        Read-only copy of the columns, for jobs that run outside the script
+        thread. The coordinate index is not copied, so a snapshot supports the
+        derived views below but not `add`, `remove` or `relabel`.
+        """
+        snapshot = PointStore(capacity=0)
+        snapshot._x = self.x.copy()
+        snapshot._y = self.y.copy()
+        snapshot._label = self.labels.copy()
+        snapshot._size = self._size
+        snapshot._index = None
+        snapshot.version = self.version
+        return snapshot
+
+    def fingerprint(self):
+        """
+        Hash of the points and labels. Unlike `version`, it is the same for
+        the same annotations in every session.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for column in (self.x, self.y, self.labels):
+            digest.update(np.ascontiguousarray(column).tobytes())
+        return digest.hexdigest()
+
+    # Derived views
+    def points(self):
+        """(n, 2) array of x, y pairs, in the format expected by `pointdet`."""
+        return np.column_stack((self.x, self.y))
+
+    def label_ids(self):
+        """Array of label ids aligned with `points()`."""
+        return self.labels.copy()
+
+    def class_counts(self, num_classes):
+        """Number of points per label id, as an array of length `num_classes`."""
+        return np.bincount(self.labels, minlength=num_classes)
+
+    def rows(self, label_list):
+        """Yields (x, y, label name) rows, in the format of the annotation CSV."""
+        for x, y, label_id in zip(self.x.tolist(), self.y.tolist(), self.labels.tolist()):
+            yield x, y, label_list[label_id]
+
+    def to_csv(self, label_list):
+        """Annotation CSV (X, Y, Label) with the current points."""
+        csv_buffer = io.StringIO()
+        csv_writer = csv.writer(csv_buffer)
+        csv_writer.writerow(["X", "Y", "Label"])
+        csv_writer.writerows(self.rows(label_list))
+        return csv_buffer.getvalue()
@@ -2,6 +2,7 @@
 import numpy as np
 from PIL import Image, ImageDraw
 import cv2
+import streamlit as st
 
 from image_annotation import *
 
@@ -75,35 +76,6 @@ def ann_correction(session_state):
         with col2:
             session_state['label'] = st.selectbox("Clase:", label_list)
 
-    if 'image_file_name' in session_state:
-        st.sidebar.header("Resultados")
-        # Sidebar buttons
-        with st.sidebar:
-            image_name = session_state['image_file_name'][:-4]
-            # **1st Download Button** - CSV Annotations
-            st.download_button(
-                label="Descargar anotaciones (CSV)",
-                data=session_state['csv_data'],
-                file_name=f"{image_name}.csv",
-                mime="text/csv"
-            )
-
-            # **2nd Download Button** - Annotation Report
-            st.download_button(
-                label="Descargar reporte (txt)",
-                data=session_state['report_data'],
-                file_name=f'{image_name}.txt',
-                mime='text/plain'
-            )
-
-            st.download_button(
-                label="Descargar imagen anotada (png)",
-                data=session_state['ann_image'],
-                file_name=f'{image_name}_annotated.png',
-                mime='image/png'
-            )
-
-
     # Image upload
     uploaded_image_file = st.file_uploader("Subir imagen ", type=["jpg", "jpeg", "png"])
     uploaded_ann_file = st.file_uploader("Subir anotaciones ", type=["csv"])
@@ -132,59 +104,61 @@ def ann_correction(session_state):
 
         # Check if a new image is uploaded
         if 'image_file_name' not in session_state or session_state['image_file_name'] != image_file_name:
+            annotator.create_dirs()
 
-            session_state['image_file_name'] = image_file_name
-
-            result = check_files(image_file_name)
-
-            if result: # Recover previous annotations
-                csv_file_name = f"{ann_dir}/{image_file_name[:-4]}.csv"
-                all_points, all_labels = read_results_from_csv(csv_file_name)
-                recover_session(session_state, all_points, all_labels, image, image_file_name[:-4])
-
-            else:
-                image.save(img_path)
-                init_session(session_state)
+            # Compact the journal of the previous image
+            if session_state.get('journal') is not None and session_state['journal'].pending:
+                compact_results(session_state, session_state['store'], session_state['image_file_name'][:-4])
 
-            store_latest_session_log(image_file_name)
+            handle_new_image(session_state, image, image_file_name, img_path, uploaded_image_file)
 
         # Check if user got disconnected
-        try:
-            # Attempt to get session data
-            all_points = session_state["all_points"]
+        if 'store' not in session_state:
+            recover_session(session_state, image_file_name[:-4])
 
-        except KeyError:
-            csv_file_name = f"{ann_dir}/{image_file_name[:-4]}.csv"
-            all_points, all_labels = read_results_from_csv(csv_file_name)
-            recover_session(session_state, all_points, all_labels, image, image_file_name[:-4])
-
-
-        update_patch_data(session_state)
 
         action = session_state['action']
         if action == actions[1]:
             mode = 'Del'
         else:
             mode = 'Transform'
-                    
+
         # Use pointdet to annotate the image
-        new_labels = pointdet(
-            image_path=img_path,
-            label_list=label_list,
-            points=session_state['points'],
-            labels=session_state['labels'],
-            width = width,
-            height = height,
-            use_space=True,
-            key=img_path,
-            mode = mode,
-            label = session_state['label'],
-            point_width=5,
-            zoom=zoom,
-        )
-        
-        # Update points and labels in session state if any changes are made
-        if new_labels is not None:
-            update_annotations(new_labels, session_state)
-            update_results(session_state, image_file_name[:-4])
-            update_ann_image(session_state, image)
+        annotation_canvas(session_state, image, image_file_name, img_path, mode, zoom)
+        store = session_state['store']
+
+        st.sidebar.header("Resultados")
+        # Sidebar buttons
+        with st.sidebar:
+            image_name = image_file_name[:-4]
+
+            # The files are built on request, and again after the annotations change
+            downloads = session_state.get('downloads')
+            if downloads is None or downloads['version'] != store.version:
+                downloads = None
+                if st.button("Preparar descargas"):
+                    downloads = prepare_downloads(session_state, store, image, image_name)
+
+            if downloads is not None:
+                # **1st Download Button** - CSV Annotations
+                st.download_button(
+                    label="Descargar anotaciones (CSV)",
+                    data=downloads['csv'],
+                    file_name=f"{image_name}.csv",
+                    mime="text/csv"
+                )
+
+                # **2nd Download Button** - Annotation Report
+                st.download_button(
+                    label="Descargar reporte (txt)",
+                    data=downloads['report'],
+                    file_name=f'{image_name}.txt',
+                    mime='text/plain'
+                )
+
+                st.download_button(
+                    label="Descargar imagen anotada (png)",
+                    data=downloads['image'],
+                    file_name=f'{image_name}_annotated.png',
+                    mime='image/png'
+                )
@@ -3,12 +3,16 @@ import streamlit.components.v1 as components
 from streamlit.components.v1.components import CustomComponent
 
 import streamlit as st
-import streamlit.elements.image as st_image
-from PIL import Image
+from streamlit import runtime
 import numpy as np
-import matplotlib.pyplot as plt
-from hashlib import md5
 from streamlit_image_annotation import IS_RELEASE
+from .image_cache import display_images, MAX_DISPLAY_SIZE, DISPLAY_FORMAT
+from .tiles import get_pyramid, TILED_CANVAS
+
+# Opt-in edit batching: the canvas sends its edits after this many
+# milliseconds without edits, or once this many are waiting (0 = send each edit)
+BATCH_IDLE_MS = int(os.environ.get("ANNOTATOR_BATCH_IDLE_MS", "0"))
+BATCH_SIZE = int(os.environ.get("ANNOTATOR_BATCH_SIZE", "20"))
 
 if IS_RELEASE:
     absolute_path = os.path.dirname(os.path.abspath(__file__))
@@ -19,6 +23,9 @@ else:
 
 def get_colormap(label_names, colormap_name='gist_rainbow', label_colors=None):
     if label_colors is None:
+        # Imported here: matplotlib is only needed when no colors are given
+        import matplotlib.pyplot as plt
+
         colormap = {} 
         cmap = plt.get_cmap(colormap_name)
         for idx, l in enumerate(label_names):
@@ -29,26 +36,108 @@ def get_colormap(label_names, colormap_name='gist_rainbow', label_colors=None):
     else:
         return {label: f'rgb({r},{g},{b})' for label, (r, g, b) in zip(label_names, label_colors)}
 
-def pointdet(image_path, label_list, points=None, labels=None, height=512, width=512, point_width=3, use_space=False, key=None, mode=None, label=None, zoom=2, label_colors=None) -> CustomComponent:
-    image = Image.open(image_path)
-    original_image_size = image.size
-    image.thumbnail(size=(width, height))
-    resized_image_size = image.size
-    scale = original_image_size[0]/resized_image_size[0]
-    
-    image_url = st_image.image_to_url(image, image.size[0], True, "RGB", "PNG", f"point-{md5(image.tobytes()).hexdigest()}-{key}")
-    if image_url.startswith('/'):
-        image_url = image_url[1:]
+def _scale_op(op, scale):
+    op = dict(op)
+    op['point'] = [b*s for b, s in zip(op['point'], scale)]
+    if 'from' in op:
+        op['from'] = [b*s for b, s in zip(op['from'], scale)]
+    return op
+
+def _image_url(display_image, key):
+    # The cached bytes are registered again on every run: Streamlit drops the
+    # media files of a session that were not used during its last run
+    if not runtime.exists():
+        return ""
+    return runtime.get_instance().media_file_mgr.add(display_image.data, display_image.mimetype, f"point-{key}")
+
+def pointdet(image_path, label_list, points=None, labels=None, height=512, width=512, point_width=3, use_space=False, key=None, mode=None, label=None, zoom=2, label_colors=None, ack=None, resync=False, max_display_size=MAX_DISPLAY_SIZE, image_format=DISPLAY_FORMAT, tiled=TILED_CANVAS, batch_idle_ms=BATCH_IDLE_MS, batch_size=BATCH_SIZE, oplog=False) -> CustomComponent:
+    """
+    Point annotation canvas.
+
+    `points` ((n, 2) x, y pairs) and `labels` (label ids) are the current
+    annotations. Returned coordinates are in the original image resolution.
+
+    Frontend builds differ in what they speak. Builds that predate the
+    operation log need every point on every render, as a list of
+    {'point', 'label_id', 'label'}, and answer with their full point list.
+    The canvas of frontend/src says in its first value that it speaks the
+    operation log (see `annotation_core.apply_component_value`, which
+    records it in `sync['oplog']`); pass that as `oplog`. Until then the
+    points are sent as that list, so any build can be shipped.
+
+    With `oplog`, the points are only sent when they are given; pass None
+    once the canvas has them, so reruns don't resend every point. They are
+    sent as parallel `x`, `y` and `label_id` columns, with the label names
+    only in `label_list`. The canvas answers with an operation log (see
+    `annotation_core.apply_component_value`): `ack` is the
+    `{'client', 'seq'}` of the last operation applied by the caller, and
+    `resync` asks the canvas to send its full point list.
+
+    With `oplog` and `batch_idle_ms`, edits are collected on the canvas and
+    sent (each send reruns the script) after that many idle milliseconds,
+    once `batch_size` edits are waiting, or when space is pressed with
+    `use_space`.
+
+    The image is shown at most `width` x `height`, and its longest side is
+    capped to `max_display_size` (None for no cap). It is sent to the browser
+    as `image_format` ("PNG", "JPEG" or "WEBP") and cached across reruns
+    (see `image_cache`).
+
+    With `tiled`, the image is instead served, whatever its size and
+    ignoring `max_display_size`, as a full-resolution tile pyramid built once
+    on disk (see `tiles`), and the canvas only fetches the tiles in view at
+    the current zoom. This needs `oplog` and
+    `server.enableStaticServing`; without them the single display image is
+    used.
+    """
+    if tiled and oplog and st.get_option("server.enableStaticServing"):
+        pyramid = get_pyramid(image_path, image_format)
+        image_url, image_size, tiles = "", pyramid.levels[0], pyramid.to_args()
+        scale = [1.0, 1.0]
+    else:
+        if max_display_size is not None:
+            width, height = min(width, max_display_size), min(height, max_display_size)
+        image = display_images.get(image_path, width, height, image_format)
+        # Per axis: the thumbnail rounds each side separately
+        scale = [o/r for o, r in zip(image.original_size, image.size)]
+        image_size, tiles = image.size, None
+
+        image_url = _image_url(image, key)
+        if image_url.startswith('/'):
+            image_url = image_url[1:]
 
     if label_colors is None:
         color_map = get_colormap(label_list, colormap_name='gist_rainbow')
     else:
         color_map = get_colormap(label_list, label_colors=label_colors)
         
-    points_info = [{'point':[b/scale for b in item[0]], 'label_id': item[1], 'label': label_list[item[1]]} for item in zip(points, labels)]
-    component_value = _component_func(image_url=image_url, image_size=image.size, label_list=label_list, points_info=points_info, color_map=color_map, point_width=point_width, use_space=use_space, key=key, mode=mode, label=label, zoom=zoom)
-    if component_value is not None:
-        component_value = [{'point':[b*scale for b in item['point']], 'label_id': item['label_id'], 'label': item['label']}for item in component_value]
+    if oplog:
+        points_info = None
+        if points is not None:
+            xy = np.asarray(points, dtype=float).reshape(-1, 2) / scale
+            points_info = {'x': xy[:, 0].tolist(), 'y': xy[:, 1].tolist(), 'label_id': np.asarray(labels, dtype=int).tolist()}
+    else:
+        # Older builds read `points_info` on every render
+        if points is None:
+            raise ValueError("pointdet needs the points on every render until the canvas speaks the operation log")
+        xy = np.asarray(points, dtype=float).reshape(-1, 2) / scale
+        points_info = [{'point': point, 'label_id': label_id, 'label': label_list[label_id]}
+                       for point, label_id in zip(xy.tolist(), np.asarray(labels, dtype=int).tolist())]
+    component_value = _component_func(image_url=image_url, image_size=image_size, tiles=tiles, label_list=label_list, points_info=points_info, color_map=color_map, point_width=point_width, use_space=use_space, key=key, mode=mode, label=label, zoom=zoom, ack=ack, resync=resync, batch={'idle_ms': batch_idle_ms, 'size': batch_size})
+    if isinstance(component_value, list):
+        # Full point list (older frontend builds)
+        component_value = [{'point':[b*s for b, s in zip(item['point'], scale)], 'label_id': item['label_id'], 'label': item['label']}for item in component_value]
+    elif component_value is not None:
+        component_value = dict(component_value)
+        if 'ops' in component_value:
+            component_value['ops'] = [_scale_op(op, scale) for op in component_value['ops']]
+        if 'full' in component_value:
+            full = component_value['full']
+            component_value['full'] = {
+                'x': np.asarray(full['x'], dtype=float) * scale[0],
+                'y': np.asarray(full['y'], dtype=float) * scale[1],
+                'label_id': np.asarray(full['label_id'], dtype=np.int64),
+            }
     return component_value
 
 if not IS_RELEASE:
@@ -56,22 +145,27 @@ if not IS_RELEASE:
     import pandas as pd
     label_list = ['deer', 'human', 'dog', 'penguin', 'framingo', 'teddy bear']
     image_path_list = glob('image/*.jpg')
+    from annotation_core import PointStore, apply_component_value, new_sync_state
     if 'result_dict' not in st.session_state:
         result_dict = {}
         for img in image_path_list:
-            result_dict[img] = {'points': [[0,0],[50,150], [200,200]],'labels':[0,3,4]}
+            result_dict[img] = {'store': PointStore.from_points([[0,0],[50,150], [200,200]], [0,3,4]), 'sync': new_sync_state()}
         st.session_state['result_dict'] = result_dict.copy()
 
 
     num_page = st.slider('page', 0, len(image_path_list)-1, 0)
     target_image_path = image_path_list[num_page]
+    store = st.session_state['result_dict'][target_image_path]['store']
+    sync = st.session_state['result_dict'][target_image_path]['sync']
     new_labels = pointdet(image_path=target_image_path, 
                            label_list=label_list, 
-                           points=st.session_state['result_dict'][target_image_path]['points'],
-                           labels=st.session_state['result_dict'][target_image_path]['labels'],
-                           point_width=3, use_space=True, key=target_image_path)
-
-    if new_labels is not None:
-        st.session_state['result_dict'][target_image_path]['points'] = [v['point'] for v in new_labels]
-        st.session_state['result_dict'][target_image_path]['labels'] = [v['label_id'] for v in new_labels]
-    st.json(st.session_state['result_dict'])
\ No newline at end of file
+                           points=store.points() if sync['push'] or not sync['oplog'] else None,
+                           labels=store.label_ids() if sync['push'] or not sync['oplog'] else None,
+                           point_width=3, use_space=True, key=target_image_path,
+                           ack={'client': sync['client'], 'seq': sync['seq']}, resync=sync['resync'], oplog=sync['oplog'])
+    sync['push'] = False
+
+    _, rerun = apply_component_value(store, new_labels, sync)
+    if rerun:
+        st.rerun()
+    st.json({img: {'points': v['store'].points().tolist(), 'labels': v['store'].label_ids().tolist()} for img, v in st.session_state['result_dict'].items()})
\ No newline at end of file
@@ -1,20 +1,110 @@
-import React, { useEffect } from "react"
-import { Layer, Stage, Image } from 'react-konva';
+import React from "react"
+import { Layer, Stage, Image, Shape } from 'react-konva';
+import useImage from 'use-image';
 import Point from './Point'
 import Konva from 'konva';
 
+export interface TilesInfo {
+  url: string,
+  tile_size: number,
+  levels: number[][],  // [width, height] of every level, full resolution first
+  ext: string
+}
+
+export interface Viewport {
+  x: number,
+  y: number,
+  width: number,
+  height: number
+}
+
+const Tile = ({ url, x, y, scale }: { url: string, x: number, y: number, scale: number }) => {
+  const [image] = useImage(url)
+  return <Image image={image} x={x} y={y} scaleX={scale} scaleY={scale} listening={false} />
+}
+
+// Tiles of the pyramid level that matches the current scale and intersect the viewport
+const visibleTiles = (tiles: TilesInfo, baseUrl: string, stageScale: number, viewport: Viewport) => {
+  const top = tiles.levels.length - 1
+  const level = Math.min(Math.max(Math.floor(Math.log2(1 / stageScale)), 0), top)
+  const tileScale = Math.pow(2, level) * stageScale  // Level pixels -> stage pixels
+  const span = tiles.tile_size * tileScale
+  const [width, height] = tiles.levels[level]
+  const lastCol = Math.ceil(width / tiles.tile_size) - 1
+  const lastRow = Math.ceil(height / tiles.tile_size) - 1
+
+  const result = []
+  // The coarsest level is a single tile, drawn underneath while the others load
+  if (level !== top) {
+    result.push({ key: `${top}/0_0`, url: `${baseUrl}${tiles.url}/${top}/0_0.${tiles.ext}`, x: 0, y: 0, scale: Math.pow(2, top) * stageScale })
+  }
+  const firstCol = Math.max(Math.floor(viewport.x / span), 0)
+  const firstRow = Math.max(Math.floor(viewport.y / span), 0)
+  const endCol = Math.min(Math.floor((viewport.x + viewport.width) / span), lastCol)
+  const endRow = Math.min(Math.floor((viewport.y + viewport.height) / span), lastRow)
+  for (let row = firstRow; row <= endRow; row++) {
+    for (let col = firstCol; col <= endCol; col++) {
+      const key = `${level}/${col}_${row}`
+      result.push({ key: key, url: `${baseUrl}${tiles.url}/${key}.${tiles.ext}`, x: col * span, y: row * span, scale: tileScale })
+    }
+  }
+  return result
+}
+
+// Points are bucketed in cells of this many image pixels to find the ones in view
+const CELL_SIZE = 128
+// Extra stage pixels drawn around the viewport, so panning doesn't show gaps
+const VIEWPORT_MARGIN = 256
+// Recently edited points stay interactive shapes
+const MAX_RECENT = 32
+
+const buildGrid = (pointsInfo: any[]) => {
+  const grid = new Map<string, any[]>()
+  for (const point of pointsInfo) {
+    const cell = `${Math.floor(point.x / CELL_SIZE)},${Math.floor(point.y / CELL_SIZE)}`
+    const bucket = grid.get(cell)
+    if (bucket) {
+      bucket.push(point)
+    } else {
+      grid.set(cell, [point])
+    }
+  }
+  return grid
+}
+
+const visiblePoints = (grid: Map<string, any[]>, stageScale: number, viewport: Viewport) => {
+  const x0 = Math.floor((viewport.x - VIEWPORT_MARGIN) / stageScale / CELL_SIZE)
+  const y0 = Math.floor((viewport.y - VIEWPORT_MARGIN) / stageScale / CELL_SIZE)
+  const x1 = Math.floor((viewport.x + viewport.width + VIEWPORT_MARGIN) / stageScale / CELL_SIZE)
+  const y1 = Math.floor((viewport.y + viewport.height + VIEWPORT_MARGIN) / stageScale / CELL_SIZE)
+  const result: any[] = []
+  for (let cy = y0; cy <= y1; cy++) {
+    for (let cx = x0; cx <= x1; cx++) {
+      const bucket = grid.get(`${cx},${cy}`)
+      if (bucket) {
+        result.push(...bucket)
+      }
+    }
+  }
+  return result
+}
+
 export interface PointCanvasProps {
   pointsInfo: any[],
   mode: string,
   selectedId: string | null,
   setSelectedId: any,
   setPointsInfo: any,
+  onEdit: (op: any) => void,
   setLabel: any,
   color_map: any,
   scale: number,
   label: string,
   image_size: number[],
   image: any,
+  tiles: TilesInfo | null,
+  tileBaseUrl: string,
+  viewport: Viewport,
   strokeWidth: number
   zoom: number
 }
@@ -26,91 +116,152 @@ const PointCanvas = (props: PointCanvasProps) => {
     selectedId,
     setSelectedId,
     setPointsInfo,
+    onEdit,
     setLabel,
     color_map,
     scale,
     label,
     image_size,
     image,
+    tiles,
+    tileBaseUrl,
+    viewport,
     strokeWidth,
     zoom
   }: PointCanvasProps = props
   
+  const stageScale = scale*zoom
+
+  // Only the points in view are drawn: static ones in a single batched
+  // shape, and the selected or recently edited ones as interactive shapes
+  const grid = React.useMemo(() => buildGrid(pointsInfo), [pointsInfo])
+  const visible = React.useMemo(() => visiblePoints(grid, stageScale, viewport), [grid, stageScale, viewport])
+  const recentIds = React.useRef<string[]>([])
+  const markRecent = (id: string) => {
+    recentIds.current = [...recentIds.current.filter((recentId) => recentId !== id), id].slice(-MAX_RECENT)
+  }
+  const isInteractive = (point: any) => point.id === selectedId || recentIds.current.includes(point.id)
+  const staticPoints = visible.filter((point) => !isInteractive(point))
+  const interactivePoints = visible.filter(isInteractive)
+
+  // Static points are not Konva nodes: clicks on them are hit-tested here
+  const findStaticPoint = (pointer: { x: number, y: number }) => {
+    const radius = strokeWidth * 1.5
+    let found = null
+    let best = radius * radius
+    for (const point of staticPoints) {
+      const dx = point.x * stageScale - pointer.x
+      const dy = point.y * stageScale - pointer.y
+      const distance = dx * dx + dy * dy
+      if (distance <= best) {
+        found = point
+        best = distance
+      }
+    }
+    return found
+  }
+
+  const clickPoint = (point: any) => {
+    if (mode === 'Transform') {
+      markRecent(point.id)
+      setSelectedId(point.id);
+      setLabel(point.label)
+    } else if (mode === 'Del') {
+      setPointsInfo(pointsInfo.filter((element) => element.id !== point.id));
+      onEdit({ op: 'delete', point: [point.x, point.y] })
+    }
+  }
+
   const checkDeselect = (e: any) => {
     if (!(e.target instanceof Konva.Circle)) {
-      if (selectedId === null && mode === 'Transform') {
-        const pointer = e.target.getStage().getPointerPosition()
+      const pointer = e.target.getStage().getPointerPosition()
+      const hit = findStaticPoint(pointer)
+      if (hit !== null) {
+        clickPoint(hit)
+      } else if (selectedId === null && mode === 'Transform') {
         const points = pointsInfo.slice();
         const new_id = Date.now().toString()
+        const x = pointer.x / stageScale
+        const y = pointer.y / stageScale
         points.push({
-          x: pointer.x / (scale*zoom),
-          y: pointer.y / (scale*zoom),
+          x: x,
+          y: y,
           label: label,
           stroke: color_map[label],
           id: new_id
         })
+        markRecent(new_id)
         setPointsInfo(points);
         setSelectedId(new_id);
+        onEdit({ op: 'add', point: [x, y], label: label })
       } else {
         setSelectedId(null);
       }
     }
   };
 
-  useEffect(() => {
-    const points = pointsInfo.slice();
-    for (let i = 0; i < points.length; i++) {
-      if (points[i].x < 0 || points[i].y < 0) {
-        points[i].x = Math.max(0, points[i].x)
-        points[i].y = Math.max(0, points[i].y)
-        setPointsInfo(points)
-      }
-      if (points[i].x > image_size[0] || points[i].y > image_size[1]) {
-        points[i].x = Math.min(points[i].x, image_size[0])
-        points[i].y = Math.min(points[i].y, image_size[1])
-        setPointsInfo(points)
+  // Draws every static point with one path per color
+  const drawStaticPoints = (context: any) => {
+    const ctx: CanvasRenderingContext2D = context._context
+    const byColor = new Map<string, any[]>()
+    for (const point of staticPoints) {
+      const group = byColor.get(point.stroke)
+      if (group) {
+        group.push(point)
+      } else {
+        byColor.set(point.stroke, [point])
       }
     }
-  }, [pointsInfo, image_size])
+    ctx.lineWidth = strokeWidth
+    byColor.forEach((group, color) => {
+      ctx.beginPath()
+      for (const point of group) {
+        const x = point.x * stageScale
+        const y = point.y * stageScale
+        ctx.moveTo(x + strokeWidth, y)
+        ctx.arc(x, y, strokeWidth, 0, 2 * Math.PI)
+      }
+      ctx.strokeStyle = color
+      ctx.stroke()
+    })
+  }
 
   return (
     <div>
       <Stage 
-        width={image_size[0] * (scale*zoom)}
-        height={image_size[1] * (scale*zoom)}
+        width={image_size[0] * stageScale}
+        height={image_size[1] * stageScale}
         onMouseDown={checkDeselect}
       >
         <Layer>
-          <Image image={image} scaleX={(scale*zoom)} scaleY={(scale*zoom)} />
+          {tiles ? (
+            visibleTiles(tiles, tileBaseUrl, stageScale, viewport).map((tile) => (
+              <Tile key={tile.key} url={tile.url} x={tile.x} y={tile.y} scale={tile.scale} />
+            ))
+          ) : (
+            <Image image={image} scaleX={stageScale} scaleY={stageScale} />
+          )}
+        </Layer>
+        <Layer listening={false}>
+          <Shape sceneFunc={drawStaticPoints} perfectDrawEnabled={false} />
         </Layer>
         <Layer>
-          {pointsInfo.map((point, i) => {
+          {interactivePoints.map((point) => {
             return (
               <Point
-                key={i}
+                key={point.id}
                 rectProps={point}
-                scale={(scale*zoom)}
+                scale={stageScale}
                 strokeWidth={strokeWidth}
                 isSelected={mode === 'Transform' && point.id === selectedId}
-                onClick={() => {
-                  if (mode === 'Transform') {
-                    setSelectedId(point.id);
-                    const points = pointsInfo.slice();
-                    const lastIndex = points.length - 1;
-                    const lastItem = points[lastIndex];
-                    points[lastIndex] = points[i];
-                    points[i] = lastItem;
-                    setPointsInfo(points);
-                    setLabel(point.label)
-                  } else if (mode === 'Del') {
-                    const points = pointsInfo.slice();
-                    setPointsInfo(points.filter((element) => element.id !== point.id));
-                  }
-                }}
+                onClick={() => clickPoint(point)}
                 onChange={(newAttrs: any) => {
-                  const points = pointsInfo.slice();
-                  points[i] = newAttrs;
-                  setPointsInfo(points);
+                  // Keep the point inside the image
+                  const x = Math.min(Math.max(0, newAttrs.x), image_size[0])
+                  const y = Math.min(Math.max(0, newAttrs.y), image_size[1])
+                  markRecent(point.id)
+                  setPointsInfo(pointsInfo.map((element) => element.id === point.id ? { ...newAttrs, x: x, y: y } : element));
+                  onEdit({ op: 'move', from: [point.x, point.y], point: [x, y] })
                 }}
               />
             );
@@ -121,4 +272,4 @@ const PointCanvas = (props: PointCanvasProps) => {
   );
 };
 
-export default PointCanvas;
\ No newline at end of file
+export default PointCanvas;
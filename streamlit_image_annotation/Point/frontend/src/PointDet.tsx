@@ -8,24 +8,43 @@ import { ChakraProvider, Box, Spacer, HStack, Center } from '@chakra-ui/react'
 
 import useImage from 'use-image';
 import ThemeSwitcher from './ThemeSwitcher'
-import PointCanvas from "./PointCanvas";
+import PointCanvas, { TilesInfo, Viewport } from "./PointCanvas";
+
+export interface PointsColumns {
+  x: number[],
+  y: number[],
+  label_id: number[]
+}
+
+// Point list of the first protocol, still sent until the canvas says it
+// supports the operation log
+export interface LegacyPoint {
+  point: number[],
+  label_id: number,
+  label: string
+}
 
 export interface PythonArgs {
   image_url: string,
   image_size: number[],
+  tiles: TilesInfo | null,  // Tile pyramid, instead of image_url, for large images
   label_list: string[],
-  points_info: any[],
+  points_info: PointsColumns | LegacyPoint[] | null,  // Parallel arrays (labels as ids into label_list), or the legacy list
   color_map: any,
   point_width: number,
   use_space: boolean,
   mode: string,   // <-- Added "mode" to the Python arguments
   label: string,  // <-- Added "label" to the Python arguments
-  zoom: number
+  zoom: number,
+  ack: { client: string | null, seq: number } | null,  // Last operation applied by Python
+  resync: boolean,  // Python asks for the full point list
+  batch: { idle_ms: number, size: number }  // Edit batching, idle_ms 0 sends every edit
 }
 const PointDet = ({ args, theme }: ComponentProps) => {
   const {
     image_url,
     image_size,
+    tiles,
     label_list,
     points_info,
     color_map,
@@ -33,14 +52,17 @@ const PointDet = ({ args, theme }: ComponentProps) => {
     use_space,
     mode,  // <-- Extract "mode" from the args
     label,  // <-- Extract "label" from the args
-    zoom
+    zoom,
+    ack,
+    resync,
+    batch
   }: PythonArgs = args
 
   const params = new URLSearchParams(window.location.search);
   const baseUrl = params.get('streamlitUrl')
-  const [image] = useImage(baseUrl + image_url)
-  const [pointsInfo, setPointsInfo] = React.useState(
-    points_info.map((p, i) => {
+  const [image] = useImage(tiles ? '' : baseUrl + image_url)
+  const toPointsInfo = (info: PointsColumns | LegacyPoint[]) => Array.isArray(info)
+    ? info.map((p, i) => {
       return {
         x: p.point[0],
         y: p.point[1],
@@ -49,7 +71,120 @@ const PointDet = ({ args, theme }: ComponentProps) => {
         id: 'point-' + i
       }
     })
-  );
+    : info.x.map((x, i) => {
+      const label = label_list[info.label_id[i]]
+      return {
+        x: x,
+        y: info.y[i],
+        label: label,
+        stroke: color_map[label],
+        id: 'point-' + i
+      }
+    })
+  const [pointsInfo, setPointsInfo] = React.useState(toPointsInfo(points_info ?? { x: [], y: [], label_id: [] }));
+
+  // Operation log: edits are sent with a sequence number and kept until
+  // Python acknowledges them, so the payload scales with the edit
+  const clientId = React.useRef(Date.now().toString(36) + Math.random().toString(36).slice(2))
+  const seqRef = React.useRef(0)
+  const pendingOps = React.useRef<any[]>([])
+  const initialized = React.useRef(points_info !== null)
+
+  // Edits recorded since the last send, and the idle timer of the current batch
+  const unsent = React.useRef(0)
+  const batchTimer = React.useRef<number | null>(null)
+
+  const sendPendingOps = () => {
+    if (batchTimer.current !== null) {
+      window.clearTimeout(batchTimer.current)
+      batchTimer.current = null
+    }
+    unsent.current = 0
+    Streamlit.setComponentValue({
+      client: clientId.current,
+      seq: seqRef.current,
+      ops: pendingOps.current
+    })
+  }
+
+  const recordOp = (op: any) => {
+    seqRef.current += 1
+    const { label, ...rest } = op
+    const entry = label === undefined
+      ? { ...rest, seq: seqRef.current }
+      : { ...rest, seq: seqRef.current, label_id: label_list.indexOf(label) }
+    pendingOps.current = [...pendingOps.current, entry]
+    unsent.current += 1
+
+    if (!batch || batch.idle_ms <= 0 || unsent.current >= batch.size) {
+      sendPendingOps()
+    } else {
+      if (batchTimer.current !== null) {
+        window.clearTimeout(batchTimer.current)
+      }
+      batchTimer.current = window.setTimeout(sendPendingOps, batch.idle_ms)
+    }
+  }
+
+  // Edits still waiting for the idle timer are sent when the canvas loses
+  // focus (switching images goes through the page around it), when the
+  // frame is unloaded and when the canvas unmounts, so none are lost
+  useEffect(() => {
+    const flushPendingOps = () => {
+      if (unsent.current > 0) {
+        sendPendingOps()
+      }
+    }
+    window.addEventListener('blur', flushPendingOps);
+    window.addEventListener('pagehide', flushPendingOps);
+    return () => {
+      window.removeEventListener('blur', flushPendingOps);
+      window.removeEventListener('pagehide', flushPendingOps);
+      flushPendingOps()
+    };
+  }, []);
+
+  // Drop the operations Python has already applied
+  useEffect(() => {
+    if (ack && ack.client === clientId.current) {
+      pendingOps.current = pendingOps.current.filter((op) => op.seq > ack.seq)
+    }
+  }, [ack])
+
+  // The first value tells Python that this canvas speaks the operation log
+  // (builds before it only ever send the full list), and whether it was
+  // mounted without points (e.g. after a reconnect), so they are pushed
+  useEffect(() => {
+    Streamlit.setComponentValue({ client: clientId.current, seq: 0, hello: true, oplog: true, has_points: initialized.current })
+  }, [])
+
+  // Points pushed by Python as columns replace the ones on the canvas. The
+  // legacy list, sent on every render until Python knows about the
+  // operation log, is only read on mount
+  useEffect(() => {
+    if (points_info === null || (initialized.current && Array.isArray(points_info))) {
+      return
+    }
+    initialized.current = true
+    setPointsInfo(toPointsInfo(points_info))
+  }, [points_info])
+
+  // Python lost track of the operation log: send every point once
+  useEffect(() => {
+    if (resync) {
+      seqRef.current += 1
+      pendingOps.current = []
+      Streamlit.setComponentValue({
+        client: clientId.current,
+        seq: seqRef.current,
+        full: {
+          x: pointsInfo.map((point) => point.x),
+          y: pointsInfo.map((point) => point.y),
+          label_id: pointsInfo.map((point) => label_list.indexOf(point.label))
+        }
+      })
+    }
+  }, [resync]);
 
   const [selectedId, setSelectedId] = React.useState<string | null>(null);
 
@@ -64,37 +199,42 @@ const PointDet = ({ args, theme }: ComponentProps) => {
     resizeCanvas()
   }, [image_size])
 
+  // Visible part of the stage, so only the tiles in view are fetched
+  const scrollRef = React.useRef<HTMLDivElement>(null)
+  const [viewport, setViewport] = useState<Viewport>({ x: 0, y: 0, width: window.innerWidth, height: window.innerHeight })
+  const viewportFrame = React.useRef<number | null>(null)
+  const updateViewport = () => {
+    // At most one update per animation frame while scrolling
+    if (viewportFrame.current !== null) {
+      return
+    }
+    viewportFrame.current = window.requestAnimationFrame(() => {
+      viewportFrame.current = null
+      const box = scrollRef.current
+      if (box) {
+        setViewport({ x: box.scrollLeft, y: box.scrollTop, width: box.clientWidth, height: box.clientHeight })
+      }
+    })
+  }
+  useEffect(() => {
+    window.addEventListener('resize', updateViewport);
+    updateViewport()
+    return () => {
+      window.removeEventListener('resize', updateViewport);
+    };
+  }, [scale, zoom])
+
   useEffect(() => {
     const handleKeyPress = (event: KeyboardEvent) => {
       if (use_space && event.key === ' ') { 
-        const currentPointsValue = pointsInfo.map((point, i) => {
-          return {
-            point: [point.x, point.y],
-            label_id: label_list.indexOf(point.label),
-            label: point.label
-          }
-        })
-        Streamlit.setComponentValue(currentPointsValue)
+        sendPendingOps()
       }
     };
     window.addEventListener('keydown', handleKeyPress);
     return () => {
       window.removeEventListener('keydown', handleKeyPress);
     };
-  }, [pointsInfo]); 
-
-  // This effect runs only when pointsInfo changes
-  useEffect(() => {
-    // Only set the component value when pointsInfo changes
-    const currentPointsValue = pointsInfo.map((point, i) => {
-      return {
-        point: [point.x, point.y],
-        label_id: label_list.indexOf(point.label),
-        label: point.label
-      }
-    })
-    Streamlit.setComponentValue(currentPointsValue)
-  }, [pointsInfo]); // Triggered when pointsInfo changes
+  }, [use_space]); 
 
   return (
     <ChakraProvider>
@@ -102,6 +242,8 @@ const PointDet = ({ args, theme }: ComponentProps) => {
         <Center>
           <HStack width="100%" height="100%">
             <Box 
+              ref={scrollRef}
+              onScroll={updateViewport}
               width="100%" 
               style={{
                 overflow: 'auto',  // Scrollbars enabled if content overflows
@@ -117,11 +259,15 @@ const PointDet = ({ args, theme }: ComponentProps) => {
                 scale={scale}
                 setSelectedId={setSelectedId}
                 setPointsInfo={setPointsInfo}
+                onEdit={recordOp}
                 setLabel={() => {}}
                 color_map={color_map}
                 label={label} 
                 image={image}
                 image_size={image_size}
+                tiles={tiles}
+                tileBaseUrl={baseUrl ?? ''}
+                viewport={viewport}
                 strokeWidth={point_width}
                 zoom={zoom}
               />
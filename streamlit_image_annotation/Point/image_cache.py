@@ -0,0 +1,99 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from PIL import Image
+
+# Memory budget for the display images kept across reruns, in megabytes
+CACHE_MB = int(os.environ.get("ANNOTATOR_IMAGE_CACHE_MB", "256"))
+
+# Longest side of the image sent to the canvas (0 = no cap), and its
+# transfer format (PNG, JPEG or WEBP). Both are opt-in: by default the canvas
+# gets the lossless image, since the staining intensity and color are what
+# is being annotated. Points are still stored in full-resolution pixels.
+MAX_DISPLAY_SIZE = int(os.environ.get("ANNOTATOR_DISPLAY_MAX_SIZE", "0")) or None
+DISPLAY_FORMAT = os.environ.get("ANNOTATOR_DISPLAY_FORMAT", "PNG").upper()
+DISPLAY_QUALITY = int(os.environ.get("ANNOTATOR_DISPLAY_QUALITY", "90"))
+
+MIMETYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+class DisplayImage(NamedTuple):
+    """Encoded thumbnail of an image, ready to be served to the canvas."""
+    data: bytes
+    mimetype: str
+    size: tuple
+    original_size: tuple
+
+
+class DisplayImageCache:
+    """
+    Process-wide LRU cache of the thumbnails shown by `pointdet`.
+
+    Entries are keyed by the path of the image, its modification time and
+    file size, and the requested thumbnail size and format, so an image that
+    is overwritten on disk is decoded again. Only the encoded thumbnail is
+    kept; the least recently used entries are dropped once their total
+    size exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, image_path, width, height, image_format="PNG", quality=DISPLAY_QUALITY):
+        """
+        Returns the `DisplayImage` of `image_path` that fits in `width` x
+        `height`, decoding and encoding it only on a cache miss.
+        """
+        image_format = image_format.upper()
+        if image_format not in MIMETYPES:
+            raise ValueError(f"Unsupported display format '{image_format}', expected one of {list(MIMETYPES)}")
+
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, width, height, image_format, quality)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = self._load(image_path, width, height, image_format, quality)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._nbytes += len(entry.data)
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= len(evicted.data)
+        return entry
+
+    @staticmethod
+    def _load(image_path, width, height, image_format, quality):
+        image = Image.open(image_path)
+        original_size = image.size
+        image.thumbnail(size=(width, height))
+
+        if image_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+
+        image_buffer = io.BytesIO()
+        if image_format == "PNG":
+            image.save(image_buffer, format=image_format)
+        else:
+            image.save(image_buffer, format=image_format, quality=quality)
+        return DisplayImage(image_buffer.getvalue(), MIMETYPES[image_format], image.size, original_size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+display_images = DisplayImageCache()
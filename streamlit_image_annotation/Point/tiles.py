@@ -0,0 +1,150 @@
+import json
+import os
+import shutil
+import threading
+from hashlib import md5
+from pathlib import Path
+from typing import NamedTuple
+
+from PIL import Image
+
+from .image_cache import MIMETYPES, DISPLAY_QUALITY
+
+# Opt-in: ANNOTATOR_TILED_CANVAS=1 serves every image, whatever its size, as a
+# tile pyramid instead of a single display image (see `pointdet`). The
+# deployment must also turn on Streamlit's static file serving, which is off
+# by default and is left off otherwise:
+#
+#     # .streamlit/config.toml
+#     [server]
+#     enableStaticServing = true
+#
+# or STREAMLIT_SERVER_ENABLE_STATIC_SERVING=true. Without it the canvas keeps
+# using the single display image.
+TILED_CANVAS = os.environ.get("ANNOTATOR_TILED_CANVAS", "0") == "1"
+TILE_SIZE = int(os.environ.get("ANNOTATOR_TILE_SIZE", "256"))
+
+# Tiles are served by Streamlit's static file serving (server.enableStaticServing),
+# which exposes the "static" folder next to the main script under "app/static"
+TILE_DIR = Path(os.environ.get("ANNOTATOR_TILE_DIR", "static/tiles"))
+TILE_URL = os.environ.get("ANNOTATOR_TILE_URL", "app/static/tiles")
+
+MANIFEST = "pyramid.json"
+EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp"}
+
+
+class TilePyramid(NamedTuple):
+    """
+    Multi-resolution tiles of an image. Level 0 is the full resolution and
+    every level halves the previous one, down to a level that fits in a
+    single tile. Tile (col, row) of level L is at `{url}/{L}/{col}_{row}.{ext}`.
+    """
+    url: str
+    tile_size: int
+    levels: list  # [width, height] of every level
+    ext: str
+
+    def to_args(self):
+        """Arguments for the canvas frontend."""
+        return {"url": self.url, "tile_size": self.tile_size, "levels": self.levels, "ext": self.ext}
+
+
+_pyramids = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _digest(image_path, image_format, quality):
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}:{stat.st_mtime_ns}:{stat.st_size}:{TILE_SIZE}:{image_format}:{quality}"
+    return md5(key.encode("utf-8")).hexdigest()
+
+
+def _build(image_path, root, image_format, quality):
+    image = Image.open(image_path)
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    ext = EXTENSIONS[image_format]
+    options = {} if image_format == "PNG" else {"quality": quality}
+
+    levels = []
+    level_image = image
+    while True:
+        level = len(levels)
+        width, height = level_image.size
+        (root / str(level)).mkdir(parents=True, exist_ok=True)
+        for row, y in enumerate(range(0, height, TILE_SIZE)):
+            for col, x in enumerate(range(0, width, TILE_SIZE)):
+                tile = level_image.crop((x, y, min(x + TILE_SIZE, width), min(y + TILE_SIZE, height)))
+                tile.save(root / str(level) / f"{col}_{row}.{ext}", format=image_format, **options)
+        levels.append([width, height])
+
+        if max(width, height) <= TILE_SIZE:
+            break
+        level_image = level_image.reduce(2)
+
+    with open(root / MANIFEST, "w", encoding="utf-8") as manifest_file:
+        json.dump({"source": os.path.abspath(image_path), "tile_size": TILE_SIZE, "levels": levels, "ext": ext}, manifest_file)
+
+
+def get_pyramid(image_path, image_format="JPEG", quality=DISPLAY_QUALITY):
+    """
+    Returns the `TilePyramid` of `image_path`, building it on disk the first
+    time. Pyramids are keyed by the path, modification time and size of the
+    image, so an image that is overwritten gets a new one.
+    """
+    image_format = image_format.upper()
+    if image_format not in MIMETYPES:
+        raise ValueError(f"Unsupported tile format '{image_format}', expected one of {list(MIMETYPES)}")
+
+    digest = _digest(image_path, image_format, quality)
+    pyramid = _pyramids.get(digest)
+    if pyramid is not None:
+        return pyramid
+
+    with _locks_lock:
+        lock = _locks.setdefault(digest, threading.Lock())
+
+    with lock:
+        root = TILE_DIR / digest
+        if not (root / MANIFEST).exists():
+            # Build next to the final folder and move it in place once complete
+            staging = TILE_DIR / f"{digest}.tmp-{os.getpid()}"
+            shutil.rmtree(staging, ignore_errors=True)
+            _build(image_path, staging, image_format, quality)
+            try:
+                os.replace(staging, root)
+            except OSError:
+                # Built concurrently by another process
+                shutil.rmtree(staging, ignore_errors=True)
+
+        with open(root / MANIFEST, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+
+        pyramid = TilePyramid(f"{TILE_URL}/{digest}", manifest["tile_size"], manifest["levels"], manifest["ext"])
+        _pyramids[digest] = pyramid
+        return pyramid
+
+
+def delete_pyramids(image_path):
+    """
+    Deletes the pyramids built for `image_path`, including the ones of
+    previous versions of the file, e.g. after it was deleted.
+    """
+    source = os.path.abspath(image_path)
+    try:
+        with os.scandir(TILE_DIR) as it:
+            roots = [entry for entry in it if entry.is_dir()]
+    except FileNotFoundError:
+        return
+
+    for root in roots:
+        try:
+            with open(Path(root.path) / MANIFEST, "r", encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (FileNotFoundError, ValueError):
+            continue
+        if manifest.get("source") == source:
+            _pyramids.pop(root.name, None)
+            shutil.rmtree(root.path, ignore_errors=True)